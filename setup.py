@@ -69,6 +69,10 @@ setuptools.setup(
     python_requires=">=3.7",
     packages=setuptools.find_packages(),
     install_requires=requirements,
+    extras_require={
+        # Needed to compute BLAKE3 digests
+        "blake3": ["blake3"],
+    },
     entry_points={
         "console_scripts": [
             "WfExS-backend=wfexs_backend.__main__:main",
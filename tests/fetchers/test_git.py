@@ -1,134 +1,266 @@
 import pytest
 import logging
 from wfexs_backend.common import RemoteRepo, RepoType
-from wfexs_backend.fetchers.git import guess_git_repo_params
+from wfexs_backend.fetchers.git import GitFetcher, guess_git_repo_params
+
+
+@pytest.fixture(scope="session")
+def logger():
+    return logging.Logger("name")
 
 
 @pytest.mark.parametrize(
     ["url", "expected"],
     [
-        (
+        pytest.param(
             "https://github.com/inab/WfExS-backend.git",
             RemoteRepo(
                 repo_url="https://github.com/inab/WfExS-backend.git",
                 repo_type=RepoType.Git,
             ),
+            id="https",
         ),
-        (
+        pytest.param(
             "git+https://github.com/inab/WfExS-backend.git",
             RemoteRepo(
                 repo_url="https://github.com/inab/WfExS-backend.git",
                 repo_type=RepoType.Git,
             ),
+            id="git+https",
         ),
-        (
+        pytest.param(
             "https://github.com/inab/WfExS-backend.git@0.1.2",
             RemoteRepo(
                 repo_url="https://github.com/inab/WfExS-backend.git",
                 repo_type=RepoType.Git,
                 tag="0.1.2",
             ),
+            id="https-tag",
         ),
-        (
+        pytest.param(
+            "https://github.com/inab/WfExS-backend.git@feature/new-fetcher",
+            RemoteRepo(
+                repo_url="https://github.com/inab/WfExS-backend.git",
+                repo_type=RepoType.Git,
+                tag="feature/new-fetcher",
+            ),
+            id="https-slashed-branch",
+        ),
+        pytest.param(
             "https://github.com/inab/WfExS-backend.git#subdirectory=workflow_examples/ipc/cosifer_test1_cwl.wfex.stage",
             RemoteRepo(
                 repo_url="https://github.com/inab/WfExS-backend.git",
                 repo_type=RepoType.Git,
                 rel_path="workflow_examples/ipc/cosifer_test1_cwl.wfex.stage",
             ),
+            id="https-subdirectory",
+        ),
+        pytest.param(
+            "https://github.com/inab/WfExS-backend.git@0.1.2#subdirectory=workflow_examples/ipc/cosifer_test1_cwl.wfex.stage",
+            RemoteRepo(
+                repo_url="https://github.com/inab/WfExS-backend.git",
+                repo_type=RepoType.Git,
+                tag="0.1.2",
+                rel_path="workflow_examples/ipc/cosifer_test1_cwl.wfex.stage",
+            ),
+            id="https-tag-subdirectory",
         ),
-        (
+        pytest.param(
             "ssh://git@github.com:inab/WfExS-backend.git",
             RemoteRepo(
                 repo_url="git@github.com:inab/WfExS-backend.git",
                 repo_type=RepoType.Git,
             ),
+            id="ssh",
         ),
-        (
+        pytest.param(
             "git+ssh://git@github.com:inab/WfExS-backend.git",
             RemoteRepo(
                 repo_url="git@github.com:inab/WfExS-backend.git",
                 repo_type=RepoType.Git,
             ),
+            id="git+ssh",
         ),
-        (
+        pytest.param(
             "ssh://git@github.com:inab/WfExS-backend.git@0.1.2",
             RemoteRepo(
                 repo_url="git@github.com:inab/WfExS-backend.git",
                 repo_type=RepoType.Git,
                 tag="0.1.2",
             ),
+            id="ssh-tag",
         ),
-        (
+        pytest.param(
             "ssh://git@github.com:inab/WfExS-backend.git#subdirectory=workflow_examples/ipc/cosifer_test1_cwl.wfex.stage",
             RemoteRepo(
                 repo_url="git@github.com:inab/WfExS-backend.git",
                 repo_type=RepoType.Git,
                 rel_path="workflow_examples/ipc/cosifer_test1_cwl.wfex.stage",
             ),
+            id="ssh-subdirectory",
         ),
-        (
+        pytest.param(
             "file:///inab/WfExS-backend/.git",
             RemoteRepo(
                 repo_url="file:///inab/WfExS-backend/.git",
                 repo_type=RepoType.Git,
             ),
+            id="file",
         ),
-        (
+        pytest.param(
             "git+file:///inab/WfExS-backend/.git",
             RemoteRepo(
                 repo_url="file:///inab/WfExS-backend/.git",
                 repo_type=RepoType.Git,
             ),
+            id="git+file",
         ),
-        (
+        pytest.param(
             "file:///inab/WfExS-backend/.git@0.1.2",
             RemoteRepo(
                 repo_url="file:///inab/WfExS-backend/.git",
                 repo_type=RepoType.Git,
                 tag="0.1.2",
             ),
+            id="file-tag",
         ),
-        (
+        pytest.param(
             "file:///inab/WfExS-backend/.git#subdirectory=workflow_examples/ipc/cosifer_test1_cwl.wfex.stage",
             RemoteRepo(
                 repo_url="file:///inab/WfExS-backend/.git",
                 repo_type=RepoType.Git,
                 rel_path="workflow_examples/ipc/cosifer_test1_cwl.wfex.stage",
             ),
+            id="file-subdirectory",
         ),
-        (
+        pytest.param(
             "github.com/inab/WfExS-backend.git",
             None,
+            id="no-scheme",
         ),
-        (
+        pytest.param(
             "git@github.com:inab/WfExS-backend.git",
             None,
+            id="scp-like",
         ),
-        (
+        pytest.param(
             "ssh://git@github.com:inab/WfExS-backend",
             RemoteRepo(
                 repo_url="git@github.com:inab/WfExS-backend",
                 repo_type=RepoType.Git,
             ),
+            id="ssh-no-git-suffix",
         ),
-        (
+        pytest.param(
             "https://github.com/inab/WfExS-backend",
             RemoteRepo(
                 repo_url="https://github.com/inab/WfExS-backend",
                 repo_type=RepoType.Git,
             ),
+            id="https-no-git-suffix",
         ),
-        (
+        pytest.param(
             "file:///inab/WfExS-backend",
             RemoteRepo(
                 repo_url="file:///inab/WfExS-backend",
                 repo_type=RepoType.Git,
             ),
+            id="file-no-git-suffix",
         ),
     ],
 )
-def test_guess_git_repo_params(url, expected):
-    logger = logging.Logger("name")
+def test_guess_git_repo_params(url, expected, logger):
     output = guess_git_repo_params(url, logger=logger)
     assert output == expected
+
+
+@pytest.mark.parametrize(
+    ["url", "expected"],
+    [
+        pytest.param(
+            "github:inab/WfExS-backend",
+            "git+https://github.com/inab/WfExS-backend.git",
+            id="github",
+        ),
+        pytest.param(
+            "github:inab/WfExS-backend/0.1.2",
+            "git+https://github.com/inab/WfExS-backend.git@0.1.2",
+            id="github-tag",
+        ),
+        pytest.param(
+            "github:inab/WfExS-backend/0.1.2/workflow_examples/ipc/cosifer_test1_cwl.wfex.stage",
+            "git+https://github.com/inab/WfExS-backend.git@0.1.2#subdirectory=workflow_examples/ipc/cosifer_test1_cwl.wfex.stage",
+            id="github-tag-subdirectory",
+        ),
+    ],
+)
+def test_github_scheme_redirect(url, expected, tmp_path):
+    fetcher = GitFetcher(progs={})
+    output = fetcher.fetch(url, tmp_path / "cached")
+    assert output.kind_or_resolved == expected
+
+
+def test_fetch_many_keeps_order(tmp_path):
+    fetcher = GitFetcher(progs={})
+    urls = [
+        "github:inab/WfExS-backend/0.1.2",
+        "github:inab/WfExS-backend",
+        "github:inab/WfExS-backend/0.1.2/workflow_examples",
+    ]
+    outputs = fetcher.fetch_many(
+        urls, [tmp_path / f"cached{i}" for i in range(len(urls))]
+    )
+    assert [output.kind_or_resolved for output in outputs] == [
+        "git+https://github.com/inab/WfExS-backend.git@0.1.2",
+        "git+https://github.com/inab/WfExS-backend.git",
+        "git+https://github.com/inab/WfExS-backend.git@0.1.2#subdirectory=workflow_examples",
+    ]
+
+
+def test_ls_remote_is_cached(monkeypatch):
+    import dulwich.porcelain
+
+    calls = []
+
+    def fake_ls_remote(url):
+        calls.append(url)
+        return {b"HEAD": b"0" * 40}
+
+    monkeypatch.setattr(dulwich.porcelain, "ls_remote", fake_ls_remote)
+    monkeypatch.setattr(GitFetcher, "_ls_remote_cache", dict())
+
+    url = "https://example.org/cached-refs.git"
+    assert GitFetcher._ls_remote(url) == {b"HEAD": b"0" * 40}
+    assert GitFetcher._ls_remote(url) == {b"HEAD": b"0" * 40}
+    assert calls == [url]
+
+    monkeypatch.setattr(GitFetcher, "LS_REMOTE_TTL", 0.0)
+    GitFetcher._ls_remote(url)
+    assert calls == [url, url]
+
+
+@pytest.mark.parametrize(
+    ["url", "expects_pool"],
+    [
+        pytest.param("https://example.org/repo.git", True, id="https"),
+        pytest.param("ssh://git@example.org/repo.git", False, id="ssh"),
+        pytest.param("git://example.org/repo.git", False, id="git"),
+    ],
+)
+def test_dulwich_clone_pool_manager_only_for_http(
+    url, expects_pool, monkeypatch, tmp_path
+):
+    import dulwich.porcelain
+
+    clone_kwargs = []
+
+    def fake_clone(source, target, **kwargs):
+        clone_kwargs.append(kwargs)
+        raise OSError("no network in tests")
+
+    monkeypatch.setattr(dulwich.porcelain, "clone", fake_clone)
+
+    fetcher = GitFetcher(progs={})
+    with open(tmp_path / "stderr", mode="wb") as errstream:
+        assert not fetcher._dulwich_clone(url, None, str(tmp_path / "dest"), errstream)
+    assert ("pool_manager" in clone_kwargs[0]) == expects_pool
@@ -0,0 +1,427 @@
+import asyncio
+import datetime
+import hashlib
+import json
+import os
+import urllib.parse
+import zipfile
+
+import magic
+import pytest
+from rfc6920.methods import extract_digest
+
+from wfexs_backend import ro_crate
+from wfexs_backend.common import (
+    Container,
+    ContainerType,
+    ContentKind,
+    CratableItem,
+    GeneratedContent,
+    LicensedURI,
+    LocalWorkflow,
+    MaterializedContent,
+    MaterializedInput,
+    MaterializedOutput,
+    MaterializedWorkflowEngine,
+    RemoteRepo,
+    StagedSetup,
+    WorkflowType,
+)
+from wfexs_backend.ro_crate import _hex_signature, _scan_file
+from wfexs_backend.utils.digests import (
+    ComputeDigestFromFile,
+    hexDigest,
+    stringifyDigest,
+)
+
+
+@pytest.mark.parametrize(
+    "payload",
+    [
+        pytest.param(b"", id="empty"),
+        pytest.param(b"Hello, world!\n" * 10, id="text"),
+        pytest.param(b"%PDF-1.4\n" + bytes(range(256)) * 8192, id="multi-block"),
+    ],
+)
+def test_scan_file_matches_separate_helpers(payload, tmp_path):
+    the_path = tmp_path / "the_file"
+    the_path.write_bytes(payload)
+
+    the_size, the_signature, the_mime = _scan_file(str(the_path))
+
+    assert the_size == os.path.getsize(the_path)
+    assert the_signature == ComputeDigestFromFile(
+        str(the_path), "sha256", repMethod=hexDigest
+    )
+    assert the_mime == magic.from_file(str(the_path), mime=True)
+
+
+def test_scan_file_rescans_when_mtime_changes(tmp_path):
+    the_path = tmp_path / "the_file"
+    the_path.write_bytes(b"aaaa")
+    os.utime(the_path, ns=(1_000_000_000, 1_000_000_000))
+    first_scan = _scan_file(str(the_path))
+
+    # Same size, different contents and modification time
+    the_path.write_bytes(b"bbbb")
+    os.utime(the_path, ns=(2_000_000_000, 2_000_000_000))
+    second_scan = _scan_file(str(the_path))
+
+    assert first_scan[0] == second_scan[0] == 4
+    assert first_scan[1] != second_scan[1]
+
+
+def test_scan_file_cache_is_bounded(monkeypatch, tmp_path):
+    monkeypatch.setattr(ro_crate, "SCAN_CACHE_SIZE", 2)
+    monkeypatch.setattr(ro_crate, "_inode_scan_cache", dict())
+
+    the_paths = []
+    for i in range(3):
+        the_path = tmp_path / f"file{i}"
+        the_path.write_bytes(str(i).encode("ascii"))
+        the_paths.append(the_path)
+        _scan_file(str(the_path))
+
+    # The oldest entry is the evicted one
+    assert len(ro_crate._inode_scan_cache) == 2
+    cached_inodes = {inode_key[1] for inode_key in ro_crate._inode_scan_cache}
+    assert cached_inodes == {os.stat(the_path).st_ino for the_path in the_paths[1:]}
+
+
+def _recursive_has_parts(the_path, the_uri, has_parts):
+    """
+    The order of the parts of each dataset, as the recursive walk
+    (the one previous to the iterative one) stated them
+    """
+    the_files = []
+    # Dataset identifiers always end with a slash
+    dir_parts = has_parts.setdefault(the_uri + "/", [])
+    with os.scandir(the_path) as the_dir:
+        for the_file in the_dir:
+            if the_file.name[0] == ".":
+                continue
+            the_item_uri = the_uri + "/" + urllib.parse.quote(the_file.name, safe="")
+            if the_file.is_file():
+                dir_parts.append(the_item_uri)
+                the_files.append(the_item_uri)
+            elif the_file.is_dir():
+                the_subfiles = _recursive_has_parts(
+                    the_file.path, the_item_uri, has_parts
+                )
+                dir_parts.append(the_item_uri + "/")
+                dir_parts.extend(the_subfiles)
+                the_files.extend(the_subfiles)
+
+    return the_files
+
+
+class _CrateEngine:
+    """
+    The only features of a workflow engine used to build the crates
+    """
+
+    workflowType = WorkflowType(
+        engineName="testengine",
+        shortname="test",
+        name="Test Workflow Language",
+        clazz=object,
+        uriMatch=[],
+        uriTemplate="https://example.org/test-lang/{}/",
+        url="https://example.org/test-lang/",
+        trs_descriptor="TEST",
+        rocrate_programming_language="test",
+    )
+    engine_url = "https://example.org/test-engine"
+
+
+@pytest.fixture
+def wrroc_factory(tmp_path):
+    """
+    It builds crates through the real constructor, from a minimal
+    staged workflow
+    """
+    work_dir = tmp_path / "work"
+    workflow_dir = work_dir / "workflow"
+    workflow_dir.mkdir(parents=True)
+    (workflow_dir / "main.test").write_text("# A test workflow\n")
+    for sub_dir in ("inputs", "outputs", "intermediate", "meta", "tmp"):
+        (work_dir / sub_dir).mkdir()
+
+    local_workflow = LocalWorkflow(
+        dir=str(workflow_dir), relPath="main.test", effectiveCheckout="0" * 40
+    )
+    staged_setup = StagedSetup(
+        instance_id="test-instance",
+        nickname="test",
+        creation=datetime.datetime.now(tz=datetime.timezone.utc),
+        workflow_config=None,
+        engine_tweaks_dir=None,
+        raw_work_dir=str(work_dir),
+        work_dir=str(work_dir),
+        workflow_dir=str(workflow_dir),
+        inputs_dir=str(work_dir / "inputs"),
+        outputs_dir=str(work_dir / "outputs"),
+        intermediate_dir=str(work_dir / "intermediate"),
+        meta_dir=str(work_dir / "meta"),
+        temp_dir=str(work_dir / "tmp"),
+        secure_exec=False,
+        allow_other=False,
+        is_encrypted=False,
+        is_damaged=False,
+    )
+
+    def _factory(**kwargs):
+        return ro_crate.WorkflowRunROCrate(
+            RemoteRepo(
+                repo_url="https://example.org/repo.git",
+                web_url="https://example.org/repo/main.test",
+            ),
+            local_workflow,
+            MaterializedWorkflowEngine(
+                instance=_CrateEngine(),
+                version="1.0",
+                fingerprint="1.0",
+                engine_path=str(tmp_path / "engine"),
+                workflow=local_workflow,
+            ),
+            None,
+            None,
+            None,
+            None,
+            staged_setup=staged_setup,
+            **kwargs,
+        )
+
+    return _factory
+
+
+def test_directory_dataset_has_part_order(wrroc_factory, tmp_path):
+    the_root = tmp_path / "root"
+    for rel_path in (
+        "a.txt",
+        "b/c.txt",
+        "b/d/e.txt",
+        "b/d/f.txt",
+        "b/.hidden",
+        "g/h.txt",
+        "i.txt",
+        "j/k/l/m.txt",
+    ):
+        the_file = the_root / rel_path
+        the_file.parent.mkdir(parents=True, exist_ok=True)
+        the_file.write_text(rel_path)
+    (the_root / "empty").mkdir()
+
+    the_uri = "https://example.org/root"
+    expected_has_parts = dict()
+    expected_files = _recursive_has_parts(str(the_root), the_uri, expected_has_parts)
+
+    wrroc = wrroc_factory()
+    crate_dataset, the_files_crates = wrroc._add_directory_as_dataset(
+        str(the_root), the_uri, do_attach=False
+    )
+
+    assert crate_dataset.id == the_uri + "/"
+    assert [the_file.id for the_file in the_files_crates] == expected_files
+    for dataset_uri, dataset_parts in expected_has_parts.items():
+        has_part = wrroc.crate.get(dataset_uri).properties().get("hasPart", [])
+        assert [part["@id"] for part in has_part] == dataset_parts
+
+
+def test_write_zip_stores_members(tmp_path):
+    payloads = {
+        "a.txt": b"Hello, world!\n",
+        "data/b.bin": os.urandom(3 * 1024 * 1024 + 5),
+        "data/empty": b"",
+    }
+    crate = ro_crate.FixedROCrate(gen_preview=False)
+    for dest_path, payload in payloads.items():
+        source = tmp_path / "sources" / dest_path
+        source.parent.mkdir(parents=True, exist_ok=True)
+        source.write_bytes(payload)
+        the_file = crate.add_file(source=str(source), dest_path=dest_path)
+        # Not every rocrate-py release knows about it
+        the_file.record_size = False
+
+    out_path = crate.write_zip(str(tmp_path / "crate.zip"))
+
+    assert out_path == tmp_path / "crate.zip"
+    with zipfile.ZipFile(out_path) as archive:
+        members = {zinfo.filename: zinfo for zinfo in archive.infolist()}
+        assert set(payloads.keys()) | {"ro-crate-metadata.json"} <= set(members.keys())
+        for zinfo in members.values():
+            assert zinfo.compress_type == zipfile.ZIP_STORED
+        for dest_path, payload in payloads.items():
+            assert members[dest_path].file_size == len(payload)
+            assert archive.read(dest_path) == payload
+
+        metadata = json.loads(archive.read("ro-crate-metadata.json"))
+    assert {"a.txt", "data/b.bin", "data/empty"} <= {
+        entity["@id"] for entity in metadata["@graph"]
+    }
+
+
+def test_write_wrroc_async(wrroc_factory, tmp_path):
+    source = tmp_path / "a.txt"
+    source.write_text("Hello, world!\n")
+    wrroc = wrroc_factory()
+    the_file = wrroc.crate.add_file(source=str(source), dest_path="a.txt")
+    the_file.record_size = False
+
+    zip_path = tmp_path / "crate.zip"
+    asyncio.run(wrroc.writeWRROC_async(str(zip_path)))
+
+    assert zipfile.is_zipfile(zip_path)
+    with zipfile.ZipFile(zip_path) as archive:
+        assert archive.read("a.txt") == b"Hello, world!\n"
+
+
+@pytest.mark.parametrize("hash_non_attached", [True, False])
+def test_non_attached_input_digests(hash_non_attached, wrroc_factory, tmp_path):
+    the_path = tmp_path / "work" / "inputs" / "in.txt"
+    the_path.write_text("Hello, world!\n")
+    the_uri = "https://example.org/in.txt"
+
+    wrroc = wrroc_factory(hash_non_attached=hash_non_attached)
+    wrroc.addWorkflowInputs(
+        [
+            MaterializedInput(
+                name="in",
+                values=[
+                    MaterializedContent(
+                        local=str(the_path),
+                        licensed_uri=LicensedURI(uri=the_uri),
+                        prettyFilename="in.txt",
+                    )
+                ],
+            )
+        ]
+    )
+
+    the_file = wrroc.crate.get(the_uri).properties()
+    assert the_file["contentSize"] == os.path.getsize(the_path)
+    if hash_non_attached:
+        assert the_file["sha256"] == ComputeDigestFromFile(
+            str(the_path), "sha256", repMethod=hexDigest
+        )
+        assert the_file["encodingFormat"] == "text/plain"
+    else:
+        assert "sha256" not in the_file
+        assert "encodingFormat" not in the_file
+
+
+@pytest.mark.parametrize("hash_non_attached", [True, False])
+def test_non_attached_outputs_prescan(
+    hash_non_attached, wrroc_factory, monkeypatch, tmp_path
+):
+    the_path = tmp_path / "work" / "outputs" / "out.txt"
+    the_path.write_text("Bye, world!\n")
+
+    scanned_paths = []
+    scan_files = ro_crate._scan_files
+
+    def spy_scan_files(the_paths, the_signatures=None):
+        scanned_paths.extend(the_paths)
+        return scan_files(the_paths, the_signatures)
+
+    monkeypatch.setattr(ro_crate, "_scan_files", spy_scan_files)
+
+    wrroc = wrroc_factory(hash_non_attached=hash_non_attached)
+    wrroc._add_workflow_execution_outputs(
+        [
+            MaterializedOutput(
+                name="out",
+                kind=ContentKind.File,
+                expectedCardinality=(1, 1),
+                values=[
+                    GeneratedContent(
+                        local=str(the_path),
+                        signature=ComputeDigestFromFile(str(the_path)),
+                    )
+                ],
+            )
+        ],
+        rel_work_dir="",
+    )
+
+    assert (str(the_path) in scanned_paths) == hash_non_attached
+
+
+def test_hex_signature():
+    the_hex = hashlib.sha256(b"x").hexdigest()
+    check_digit = next(
+        d
+        for d in range(16)
+        if extract_digest(f"nih:sha-256;{the_hex};{d:x}")[0] is not False
+    )
+
+    assert _hex_signature(f"nih:sha-256;{the_hex};{check_digit:x}") == the_hex
+    assert _hex_signature(stringifyDigest("sha256", bytes.fromhex(the_hex))) == the_hex
+    with pytest.raises(ro_crate.ROCrateGenerationException):
+        _hex_signature(f"nih:sha-256;{the_hex};{(check_digit + 1) % 16:x}")
+
+
+def _container_entity(wrroc, tagged_name):
+    return next(
+        entity.properties()
+        for entity in wrroc.crate.get_entities()
+        if entity.properties().get("identifier") == tagged_name
+    )
+
+
+@pytest.mark.parametrize("algorithm", ["sha256", "blake3"])
+def test_container_signatures(algorithm, wrroc_factory, tmp_path):
+    the_path = tmp_path / "work" / "containers" / "image.sif"
+    the_path.parent.mkdir()
+    payload = b"not really a container image\n" * 100
+    the_path.write_bytes(payload)
+    # Only its representation matters, as it is not checked against the image
+    the_digest = hashlib.sha256(payload).digest()
+
+    wrroc = wrroc_factory(payloads=CratableItem.Containers)
+    wrroc._add_containers_to_workflow(
+        [
+            Container(
+                origTaggedName="example/image:1.0",
+                type=ContainerType.Singularity,
+                taggedName="docker://example/image:1.0",
+                localPath=str(the_path),
+                signature=stringifyDigest(algorithm, the_digest),
+            )
+        ]
+    )
+
+    software_container = _container_entity(wrroc, "docker://example/image:1.0")
+    assert software_container["contentSize"] == len(payload)
+    # sha256 is always there, even when the signature was a BLAKE3 one
+    assert software_container["sha256"] == hashlib.sha256(payload).hexdigest()
+    if algorithm == "blake3":
+        assert software_container["blake3"] == the_digest.hex()
+    else:
+        assert "blake3" not in software_container
+
+
+def test_container_invalid_signature(wrroc_factory, tmp_path):
+    the_path = tmp_path / "work" / "containers" / "image.sif"
+    the_path.parent.mkdir()
+    the_path.write_bytes(b"x")
+    the_hex = hashlib.sha256(b"x").hexdigest()
+    bad_check_digit = next(
+        d
+        for d in range(16)
+        if extract_digest(f"nih:sha-256;{the_hex};{d:x}")[0] is False
+    )
+
+    wrroc = wrroc_factory(payloads=CratableItem.Containers)
+    with pytest.raises(ro_crate.ROCrateGenerationException):
+        wrroc._add_containers_to_workflow(
+            [
+                Container(
+                    origTaggedName="example/image:1.0",
+                    type=ContainerType.Singularity,
+                    taggedName="docker://example/image:1.0",
+                    localPath=str(the_path),
+                    signature=f"nih:sha-256;{the_hex};{bad_check_digit:x}",
+                )
+            ]
+        )
@@ -0,0 +1,63 @@
+import os
+import shutil
+import stat
+
+import pytest
+
+from wfexs_backend.utils import contents
+from wfexs_backend.utils.contents import copy2_reflink
+
+
+def test_copy2_reflink_regular_file(tmp_path):
+    src = tmp_path / "src.bin"
+    payload = os.urandom(3 * 1024 * 1024 + 17)
+    src.write_bytes(payload)
+    os.chmod(src, 0o640)
+
+    dest = copy2_reflink(str(src), str(tmp_path / "dest.bin"))
+
+    assert open(dest, mode="rb").read() == payload
+    assert stat.S_IMODE(os.stat(dest).st_mode) == 0o640
+
+
+def test_copy2_reflink_without_fcntl(monkeypatch, tmp_path):
+    # As it happens on platforms without fcntl
+    monkeypatch.setattr(contents, "fcntl", None)
+    src = tmp_path / "src.bin"
+    payload = os.urandom(1024 * 1024 + 17)
+    src.write_bytes(payload)
+
+    dest = copy2_reflink(str(src), str(tmp_path / "dest.bin"))
+
+    assert open(dest, mode="rb").read() == payload
+
+
+def test_copy2_reflink_into_directory(tmp_path):
+    src = tmp_path / "src.txt"
+    src.write_text("hello")
+    dest_dir = tmp_path / "dest"
+    dest_dir.mkdir()
+
+    dest = copy2_reflink(str(src), str(dest_dir))
+
+    assert dest == str(dest_dir / "src.txt")
+    assert (dest_dir / "src.txt").read_text() == "hello"
+
+
+def test_copy2_reflink_fifo(tmp_path):
+    src = tmp_path / "src.fifo"
+    os.mkfifo(src)
+
+    # shutil refuses to copy FIFOs, instead of blocking on open
+    with pytest.raises(shutil.SpecialFileError):
+        copy2_reflink(str(src), str(tmp_path / "dest"))
+    assert not (tmp_path / "dest").exists()
+
+
+@pytest.mark.skipif(
+    not os.path.exists("/proc/self/status"), reason="procfs is not available"
+)
+def test_copy2_reflink_procfs(tmp_path):
+    dest = copy2_reflink("/proc/self/status", str(tmp_path / "status"))
+
+    assert os.path.getsize(dest) > 0
@@ -0,0 +1,79 @@
+import hashlib
+import io
+import sys
+
+import pytest
+
+from wfexs_backend.utils.digests import (
+    BLAKE3_DIGEST_ALGORITHM,
+    ComputeDigestFromFile,
+    ComputeDigestFromFileLike,
+    DigestAlgorithmUnavailableException,
+    stringifyDigest,
+)
+
+
+@pytest.mark.parametrize("algorithm", ["sha256", "sha512", "sha1"])
+@pytest.mark.parametrize(
+    "size",
+    [
+        pytest.param(0, id="empty"),
+        pytest.param(100, id="small"),
+        pytest.param(1024 * 1024, id="one-buffer"),
+        pytest.param(3 * 1024 * 1024 + 7, id="several-buffers"),
+    ],
+)
+def test_compute_digest_from_file(algorithm, size, tmp_path):
+    payload = bytes(range(256)) * (size // 256) + bytes(size % 256)
+    the_path = tmp_path / "the_file"
+    the_path.write_bytes(payload)
+
+    assert ComputeDigestFromFile(str(the_path), algorithm) == stringifyDigest(
+        algorithm, hashlib.new(algorithm, payload).digest()
+    )
+
+
+class _NoReadInto:
+    """
+    A file-like object which only offers read
+    """
+
+    def __init__(self, payload):
+        self._stream = io.BytesIO(payload)
+
+    def read(self, size=-1):
+        return self._stream.read(size)
+
+
+@pytest.mark.parametrize("buffer_size", [1, 1000, 65536])
+def test_compute_digest_from_file_like(buffer_size):
+    payload = b"0123456789" * 10000
+    expected = stringifyDigest("sha256", hashlib.sha256(payload).digest())
+
+    assert (
+        ComputeDigestFromFileLike(io.BytesIO(payload), bufferSize=buffer_size)
+        == expected
+    )
+    assert (
+        ComputeDigestFromFileLike(_NoReadInto(payload), bufferSize=buffer_size)
+        == expected
+    )
+
+
+def test_compute_digest_blake3(tmp_path):
+    blake3 = pytest.importorskip("blake3")
+    payload = b"0123456789" * 200000
+    the_path = tmp_path / "the_file"
+    the_path.write_bytes(payload)
+
+    assert ComputeDigestFromFile(
+        str(the_path), BLAKE3_DIGEST_ALGORITHM
+    ) == stringifyDigest(BLAKE3_DIGEST_ALGORITHM, blake3.blake3(payload).digest())
+
+
+def test_compute_digest_blake3_unavailable(monkeypatch):
+    # A None entry makes the import fail, even when blake3 is installed
+    monkeypatch.setitem(sys.modules, "blake3", None)
+
+    with pytest.raises(DigestAlgorithmUnavailableException):
+        ComputeDigestFromFileLike(io.BytesIO(b"x"), BLAKE3_DIGEST_ALGORITHM)
@@ -163,12 +163,8 @@ class SchemeHandlerCacheHandler:
         schemeHandlers: "Mapping[str, ProtocolFetcher]" = dict(),
     ):
         # Getting a logger focused on specific classes
-        import inspect
-
         self.logger = logging.getLogger(
-            dict(inspect.getmembers(self))["__module__"]
-            + "::"
-            + self.__class__.__name__
+            self.__class__.__module__ + "::" + self.__class__.__name__
         )
 
         # TODO: create caching database
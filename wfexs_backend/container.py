@@ -25,7 +25,6 @@ import shutil
 import subprocess
 import abc
 import logging
-import inspect
 
 from typing import (
     cast,
@@ -114,9 +113,7 @@ class ContainerFactory(abc.ABC):
 
         # Getting a logger focused on specific classes
         self.logger = logging.getLogger(
-            dict(inspect.getmembers(self))["__module__"]
-            + "::"
-            + self.__class__.__name__
+            self.__class__.__module__ + "::" + self.__class__.__name__
         )
 
         # cacheDir
@@ -99,12 +99,8 @@ class AbstractStatefulFetcher(abc.ABC):
         progs: "ProgsMapping" = dict(),
         setup_block: "Optional[Mapping[str, Any]]" = None,
     ):
-        import inspect
-
         self.logger = logging.getLogger(
-            dict(inspect.getmembers(self))["__module__"]
-            + "::"
-            + self.__class__.__name__
+            self.__class__.__module__ + "::" + self.__class__.__name__
         )
         # This is used to resolve program names
         self.progs = progs
@@ -16,12 +16,17 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-import atexit
+import concurrent.futures
+import fcntl
+import functools
 import hashlib
 import os
+import re
 import shutil
 import subprocess
 import tempfile
+import threading
+import time
 from typing import (
     cast,
     TYPE_CHECKING,
@@ -30,12 +35,24 @@ from typing import (
 if TYPE_CHECKING:
     import logging
 
+    import dulwich.repo
+    import urllib3
+
+    from dulwich.objects import (
+        ObjectID,
+    )
+    from dulwich.refs import (
+        Ref,
+    )
+
     from typing import (
         Any,
+        BinaryIO,
         Mapping,
         MutableMapping,
         MutableSequence,
         Optional,
+        Pattern,
         Tuple,
         Type,
         Union,
@@ -66,8 +83,6 @@ if TYPE_CHECKING:
 
 from urllib import parse, request
 
-import dulwich.porcelain
-
 from . import (
     AbstractRepoFetcher,
     FetcherException,
@@ -87,12 +102,113 @@ from ..utils.contents import link_or_copy
 GITHUB_NETLOC = "github.com"
 
 
+@functools.lru_cache(maxsize=1024)
+def _cache_paths(
+    base_repo_destdir: "str", repoURL: "str", repoTag: "Optional[str]"
+) -> "Tuple[str, str]":
+    """
+    Hashed paths of the repository cache directory and of the tag
+    checkout, which are derived over and over for the same
+    repository URLs and tags
+    """
+    repo_hashed_id = hashlib.sha1(repoURL.encode("utf-8")).hexdigest()
+    repo_destdir = os.path.join(base_repo_destdir, repo_hashed_id)
+    repo_hashed_tag_id = hashlib.sha1(
+        ("" if repoTag is None else repoTag).encode("utf-8")
+    ).hexdigest()
+
+    return repo_destdir, os.path.join(repo_destdir, repo_hashed_tag_id)
+
+
+# Parsed URLs are immutable, and the same ones are parsed once and again
+# when several fetches (or guesses) are done over the same repositories
+_parse_url = functools.lru_cache(maxsize=256)(parse.urlparse)
+
+
+def _split_repo_tag(path: "str") -> "Tuple[str, Optional[RepoTag]]":
+    """
+    The tag or branch is whatever is after the last @ in the path,
+    as pip does. So, branch names like feature/foo are kept whole.
+    """
+    git_path, sep, repo_tag = path.rpartition("@")
+    if sep:
+        return git_path, cast("RepoTag", repo_tag)
+
+    return path, None
+
+
+# Maximum number of kept connections per host, which should not be
+# smaller than the number of concurrent fetches
+HTTP_POOL_MAXSIZE: "Final[int]" = 32
+
+
+@functools.lru_cache(maxsize=1)
+def _http_pool_manager() -> "urllib3.PoolManager":
+    """
+    A single (thread safe) connection pool shared by all the in-process
+    clones, so TLS handshakes to the same forge are not repeated.
+    Dulwich builds it, honouring proxies and certificates settings.
+    """
+    import dulwich.client
+
+    pool_manager = cast(
+        "urllib3.PoolManager", dulwich.client.default_urllib3_manager(config=None)
+    )
+    pool_manager.connection_pool_kw["maxsize"] = HTTP_POOL_MAXSIZE
+
+    return pool_manager
+
+
+def _peel_commit(repo: "dulwich.repo.Repo", sha: "bytes") -> "bytes":
+    """
+    It returns the commit an (annotated) tag object points to.
+    Other objects are returned as such.
+    """
+    import dulwich.objects
+
+    the_obj = repo[sha]
+    while isinstance(the_obj, dulwich.objects.Tag):
+        the_obj = repo[the_obj.object[1]]
+
+    return cast("bytes", the_obj.id)
+
+
+HEAD_LABEL = b"HEAD"
+REFS_HEADS_PREFIX = b"refs/heads/"
+REFS_TAGS_PREFIX = b"refs/tags/"
+
+SUBDIRECTORY_KEY_PREFIX: "Final[str]" = "subdirectory="
+
+
+def _extract_subdirectory(fragment: "Optional[str]") -> "Optional[str]":
+    """
+    The only key looked for in the fragment of pip-like git URLs
+    is subdirectory, so there is no need to fully parse it
+    """
+    if fragment:
+        for frag_part in fragment.split("&"):
+            if frag_part.startswith(SUBDIRECTORY_KEY_PREFIX) and len(frag_part) > len(
+                SUBDIRECTORY_KEY_PREFIX
+            ):
+                return parse.unquote_plus(frag_part[len(SUBDIRECTORY_KEY_PREFIX) :])
+
+    return None
+
+
 class GitFetcher(AbstractRepoFetcher):
     GIT_PROTO: "Final[str]" = "git"
     GIT_PROTO_PREFIX: "Final[str]" = GIT_PROTO + "+"
     GITHUB_SCHEME: "Final[str]" = "github"
     DEFAULT_GIT_CMD: "Final[SymbolicName]" = cast("SymbolicName", "git")
 
+    # Remote refs are shared by all the fetches of the same repository
+    # done in a short time span, in order to save network round trips
+    LS_REMOTE_TTL: "Final[float]" = 30.0
+    _ls_remote_cache: "MutableMapping[RepoURL, Tuple[float, Mapping[bytes, bytes]]]" = (
+        dict()
+    )
+    _ls_remote_lock: "Final[threading.Lock]" = threading.Lock()
+
     def __init__(
         self, progs: "ProgsMapping", setup_block: "Optional[Mapping[str, Any]]" = None
     ):
@@ -102,20 +218,240 @@ class GitFetcher(AbstractRepoFetcher):
             self.DEFAULT_GIT_CMD, cast("RelPath", self.DEFAULT_GIT_CMD)
         )
 
+        # Shallow clones are used by default, as the history is not
+        # needed. It can be disabled for archival purposes
+        self.shallow = bool(self.setup_block.get("shallow", True))
+
+        # When enabled, a local mirror of each repository is kept in the
+        # cache, and the objects of every checkout are taken from it.
+        # Unless objects are shared, the checkouts are dissociated
+        # from the mirror
+        self.mirror = bool(self.setup_block.get("mirror", False))
+        self.shared_objects = bool(self.setup_block.get("shared-objects", False))
+
+        # Partial clones only fetch the blobs needed by the checkout,
+        # those from the history are lazily fetched by git when needed.
+        # It only applies to full (i.e. not shallow) clones
+        self.partial_clone = bool(self.setup_block.get("partial-clone", False))
+
+        # Temporary checkouts live as long as this fetcher does
+        # (or until the interpreter exits)
+        self._tempdirs: "MutableSequence[tempfile.TemporaryDirectory[str]]" = []
+
     @classmethod
-    def GetSchemeHandlers(cls) -> "Mapping[str, Type[AbstractStatefulFetcher]]":
+    @functools.lru_cache(maxsize=None)
+    def _scheme_handler_pairs(
+        cls,
+    ) -> "Tuple[Tuple[str, Type[AbstractStatefulFetcher]], ...]":
         # These are de-facto schemes supported by pip and git client
-        return {
-            cls.GIT_PROTO: cls,
-            cls.GIT_PROTO_PREFIX + "https": cls,
-            cls.GIT_PROTO_PREFIX + "http": cls,
-            cls.GITHUB_SCHEME: cls,
-        }
+        # The pairs are built only once per class, as they are consulted
+        # on every fetch. Being a tuple, callers cannot alter the cached value
+        return (
+            (cls.GIT_PROTO, cls),
+            (cls.GIT_PROTO_PREFIX + "https", cls),
+            (cls.GIT_PROTO_PREFIX + "http", cls),
+            (cls.GITHUB_SCHEME, cls),
+        )
+
+    @classmethod
+    def GetSchemeHandlers(cls) -> "Mapping[str, Type[AbstractStatefulFetcher]]":
+        # A fresh dict on each call, as WfExSBackend.addSchemeHandlers
+        # only accepts dict instances
+        return dict(cls._scheme_handler_pairs())
 
     @classmethod
     def GetNeededPrograms(cls) -> "Sequence[SymbolicName]":
         return (cls.DEFAULT_GIT_CMD,)
 
+    def _dulwich_clone(
+        self,
+        repoURL: "RepoURL",
+        repoTag: "Optional[RepoTag]",
+        repo_tag_destdir: "AbsPath",
+        errstream: "BinaryIO",
+        shallow: "bool" = False,
+    ) -> "bool":
+        """
+        In-process clone of the repository, avoiding spawning git.
+        Dulwich is only able to check out branches and tags, so
+        when it fails the caller should fall back to git command line.
+        Submodules are not cloned here.
+        """
+        # Imported here, as dulwich is only needed when cloning
+        import dulwich.errors
+        import dulwich.porcelain
+
+        # Only the HTTP(S) clients accept a pool manager. The ssh and git
+        # ones reject it, which would always force the git command line
+        clone_kwargs: "MutableMapping[str, Any]" = dict()
+        if _parse_url(repoURL).scheme in ("http", "https"):
+            clone_kwargs["pool_manager"] = _http_pool_manager()
+
+        destdir_existed = os.path.exists(repo_tag_destdir)
+        self.logger.debug(f"Cloning {repoURL} (tag {repoTag}) in-process")
+        try:
+            with dulwich.porcelain.clone(
+                repoURL,
+                repo_tag_destdir,
+                depth=1 if shallow else None,
+                branch=repoTag,
+                errstream=errstream,
+                **clone_kwargs,
+            ) as repo:
+                # Dulwich leaves annotated tags unpeeled in detached HEADs
+                head_commit = repo.head()
+                peeled_commit = _peel_commit(repo, head_commit)
+                if peeled_commit != head_commit:
+                    repo.refs[cast("Ref", HEAD_LABEL)] = cast("ObjectID", peeled_commit)
+        except (
+            dulwich.errors.GitProtocolError,
+            dulwich.errors.HangupException,
+            dulwich.errors.NotGitRepository,
+            OSError,
+            # Raised when the branch or tag is not found (e.g. it is
+            # an abbreviated commit), which git is able to resolve
+            ValueError,
+        ) as e:
+            self.logger.debug(
+                f"In-process clone of {repoURL} (tag {repoTag}) failed ({e}). Falling back to git command line"
+            )
+            # Removing the leftovers, so git is able to clone there
+            if destdir_existed:
+                for entry in os.scandir(repo_tag_destdir):
+                    if entry.is_dir(follow_symlinks=False):
+                        shutil.rmtree(entry.path)
+                    else:
+                        os.unlink(entry.path)
+            else:
+                shutil.rmtree(repo_tag_destdir, ignore_errors=True)
+            return False
+
+        return True
+
+    def _sync_mirror(self, repoURL: "RepoURL", mirror_dir: "str") -> "bool":
+        """
+        Create or update the local mirror of a repository, serialized
+        through a lock file, as several processes can share the cache.
+        It returns whether the mirror is usable.
+        """
+        if os.path.isdir(mirror_dir):
+            gitmirror_params = [
+                self.git_cmd,
+                "--git-dir",
+                mirror_dir,
+                "fetch",
+                "--prune",
+                "origin",
+            ]
+        else:
+            gitmirror_params = [
+                self.git_cmd,
+                "clone",
+                "--mirror",
+                repoURL,
+                mirror_dir,
+            ]
+
+        with open(mirror_dir + ".lock", mode="a") as lock_H:
+            fcntl.flock(lock_H, fcntl.LOCK_EX)
+            try:
+                self.logger.debug(f'Running "{" ".join(gitmirror_params)}"')
+                gitmirror = subprocess.run(
+                    gitmirror_params,
+                    stdout=subprocess.DEVNULL,
+                    stderr=subprocess.PIPE,
+                    encoding="iso-8859-1",
+                )
+            finally:
+                fcntl.flock(lock_H, fcntl.LOCK_UN)
+
+        if gitmirror.returncode != 0:
+            self.logger.warning(
+                f"Unable to mirror {repoURL} (retval {gitmirror.returncode}). Cloning without it. Error:\n{gitmirror.stderr}"
+            )
+            return False
+
+        return True
+
+    @classmethod
+    def _ls_remote(cls, repoURL: "RepoURL") -> "Mapping[bytes, bytes]":
+        """
+        It returns all the remote refs of the repository, from a
+        single ls-remote which is cached for a few seconds
+        """
+        now = time.monotonic()
+        with cls._ls_remote_lock:
+            cached = cls._ls_remote_cache.get(repoURL)
+        if cached is not None and now - cached[0] < cls.LS_REMOTE_TTL:
+            return cached[1]
+
+        import dulwich.porcelain
+
+        # The network round trip is done outside the lock, so
+        # different repositories can be queried in parallel
+        ls_remote = dulwich.porcelain.ls_remote(repoURL)
+
+        # Newer dulwich versions return an LsRemoteResult instead of a dict
+        refs: "object"
+        if isinstance(ls_remote, dict):
+            refs = ls_remote
+        else:
+            refs = ls_remote.refs
+        remote_refs = cast("Mapping[bytes, bytes]", refs)
+        with cls._ls_remote_lock:
+            cls._ls_remote_cache[repoURL] = (now, remote_refs)
+
+        return remote_refs
+
+    def _is_checkout_up_to_date(
+        self,
+        repoURL: "RepoURL",
+        repoTag: "Optional[RepoTag]",
+        repo_tag_destdir: "AbsPath",
+    ) -> "bool":
+        """
+        It tells whether the remote tag or branch (or the remote HEAD)
+        points to the commit already checked out, so the network
+        transfer and the reset can be skipped. On any doubt, it
+        answers no.
+        """
+        import dulwich.errors
+        import dulwich.repo
+
+        try:
+            remote_refs = self._ls_remote(repoURL)
+        except Exception as e:
+            self.logger.debug(f"Unable to list remote refs from {repoURL} ({e})")
+            return False
+
+        remote_commit: "Optional[bytes]" = None
+        if repoTag is None:
+            remote_commit = remote_refs.get(HEAD_LABEL)
+        else:
+            b_repo_tag = repoTag.encode("utf-8")
+            for remote_label in (
+                REFS_HEADS_PREFIX + b_repo_tag,
+                REFS_TAGS_PREFIX + b_repo_tag + b"^{}",
+                REFS_TAGS_PREFIX + b_repo_tag,
+            ):
+                remote_commit = remote_refs.get(remote_label)
+                if remote_commit is not None:
+                    break
+
+        if remote_commit is None:
+            return False
+
+        try:
+            with dulwich.repo.Repo(repo_tag_destdir) as repo:
+                head_commit = repo.head()
+                if remote_commit == head_commit:
+                    return True
+
+                # Annotated tags have to be peeled
+                return _peel_commit(repo, remote_commit) == head_commit
+        except (dulwich.errors.NotGitRepository, KeyError):
+            return False
+
     def doMaterializeRepo(
         self,
         repoURL: "RepoURL",
@@ -134,67 +470,107 @@ class GitFetcher(AbstractRepoFetcher):
         """
 
         # Assure directory exists before next step
+        mirror_dir: "Optional[str]" = None
         if repo_tag_destdir is None:
             if base_repo_destdir is None:
-                repo_tag_destdir = cast(
-                    "AbsPath", tempfile.mkdtemp(prefix="wfexs", suffix=".git")
+                repo_tempdir = tempfile.TemporaryDirectory(
+                    prefix="wfexs", suffix=".git"
                 )
-                atexit.register(shutil.rmtree, repo_tag_destdir)
+                self._tempdirs.append(repo_tempdir)
+                repo_tag_destdir = cast("AbsPath", repo_tempdir.name)
             else:
-                repo_hashed_id = hashlib.sha1(repoURL.encode("utf-8")).hexdigest()
-                repo_destdir = os.path.join(base_repo_destdir, repo_hashed_id)
+                repo_destdir, repo_tag_destdir_str = _cache_paths(
+                    base_repo_destdir, repoURL, repoTag
+                )
                 # repo_destdir = os.path.join(self.cacheWorkflowDir, repo_hashed_id)
 
-                if not os.path.exists(repo_destdir):
-                    try:
-                        os.makedirs(repo_destdir)
-                    except IOError:
-                        errstr = "ERROR: Unable to create intermediate directories for repo {}. ".format(
-                            repoURL
-                        )
-                        raise FetcherException(errstr)
+                try:
+                    os.makedirs(repo_destdir, exist_ok=True)
+                except OSError as ose:
+                    errstr = "ERROR: Unable to create intermediate directories for repo {}. ".format(
+                        repoURL
+                    )
+                    raise FetcherException(errstr) from ose
 
-                repo_hashed_tag_id = hashlib.sha1(
-                    b"" if repoTag is None else repoTag.encode("utf-8")
-                ).hexdigest()
-                repo_tag_destdir = cast(
-                    "AbsPath", os.path.join(repo_destdir, repo_hashed_tag_id)
-                )
+                if self.mirror:
+                    # It cannot clash with the hashed tag ids
+                    mirror_dir = os.path.join(repo_destdir, "_mirror.git")
+
+                repo_tag_destdir = cast("AbsPath", repo_tag_destdir_str)
 
         self.logger.debug(f"Repo dir {repo_tag_destdir}")
 
         # We are assuming that, if the directory does exist, it contains the repo
         doRepoUpdate = True
-        if not os.path.exists(os.path.join(repo_tag_destdir, ".git")):
-            # Try cloning the repository without initial checkout
+        gitclone_fallback_params: "Optional[Sequence[str]]" = None
+        gitfetch_params: "Optional[Sequence[str]]" = None
+        # Commit shas cannot be used with --branch, so they are
+        # always fully cloned
+        is_commit = (
+            repoTag is not None and GIT_COMMIT_SHA_PAT.fullmatch(repoTag) is not None
+        )
+        shallow_clone = self.shallow and not is_commit
+        use_mirror = False
+        if not os.path.isdir(os.path.join(repo_tag_destdir, ".git")):
+            gitclone_params = [
+                self.git_cmd,
+                "clone",
+                "--recurse-submodules",
+            ]
             if repoTag is not None:
-                gitclone_params = [
-                    self.git_cmd,
-                    "clone",
-                    "-n",
-                    "--recurse-submodules",
-                    repoURL,
-                    repo_tag_destdir,
-                ]
+                # Try cloning the repository without initial checkout
+                gitclone_params.append("-n")
+
+            if mirror_dir is not None and self._sync_mirror(repoURL, mirror_dir):
+                # Only the objects missing in the mirror are fetched
+                use_mirror = True
+                gitclone_params.extend(["--reference", mirror_dir])
+                if not self.shared_objects:
+                    gitclone_params.append("--dissociate")
+            elif shallow_clone:
+                # Only the tip of the branch or tag is fetched.
+                # The full clone is kept as fallback, for servers
+                # not supporting it or tags which are abbreviated shas
+                gitclone_fallback_params = [*gitclone_params]
+                if self.partial_clone:
+                    gitclone_fallback_params.append("--filter=blob:none")
+                gitclone_fallback_params.extend([repoURL, repo_tag_destdir])
+                gitclone_params.extend(
+                    [
+                        "--depth=1",
+                        "--shallow-submodules",
+                        "--no-tags",
+                    ]
+                )
+                if repoTag is not None:
+                    gitclone_params.extend(["--branch", repoTag])
+            elif self.partial_clone:
+                gitclone_params.append("--filter=blob:none")
 
+            gitclone_params.extend([repoURL, repo_tag_destdir])
+
+            if repoTag is not None:
                 # Now, checkout the specific commit
                 gitcheckout_params = [self.git_cmd, "checkout", repoTag]
             else:
                 # We know nothing about the tag, or checkout
-                gitclone_params = [
-                    self.git_cmd,
-                    "clone",
-                    "--recurse-submodules",
-                    repoURL,
-                    repo_tag_destdir,
-                ]
-
                 gitcheckout_params = None
-        elif doUpdate:
+        elif (
+            doUpdate
+            and not is_commit
+            and not self._is_checkout_up_to_date(repoURL, repoTag, repo_tag_destdir)
+        ):
+            # Checkouts of commit shas are immutable, so they are never updated.
+            # Neither the ones already pointing to the remote commit
             gitclone_params = None
-            gitcheckout_params = [self.git_cmd, "pull", "--recurse-submodules"]
-            if repoTag is not None:
-                gitcheckout_params.extend(["origin", repoTag])
+            # Only the requested commit is fetched, and the checkout is
+            # moved there. This avoids the merge done by git pull, which
+            # is only used as fallback
+            gitfetch_params = [self.git_cmd, "fetch"]
+            if self.shallow:
+                gitfetch_params.append("--depth=1")
+            gitfetch_params.extend(["origin", "HEAD" if repoTag is None else repoTag])
+            gitcheckout_params = [self.git_cmd, "reset", "--hard", "FETCH_HEAD"]
         else:
             doRepoUpdate = False
 
@@ -202,11 +578,60 @@ class GitFetcher(AbstractRepoFetcher):
             with tempfile.NamedTemporaryFile() as git_stdout, tempfile.NamedTemporaryFile() as git_stderr:
                 # First, (bare) clone
                 retval = 0
-                if gitclone_params is not None:
+                if (
+                    gitclone_params is not None
+                    and not is_commit
+                    and not use_mirror
+                    and (shallow_clone or not self.partial_clone)
+                    and self._dulwich_clone(
+                        repoURL,
+                        repoTag,
+                        repo_tag_destdir,
+                        errstream=cast("BinaryIO", git_stderr),
+                        shallow=shallow_clone,
+                    )
+                ):
+                    # The in-process clone has already checked out
+                    # the requested branch or tag
+                    gitcheckout_params = None
+                elif gitclone_params is not None:
                     self.logger.debug(f'Running "{" ".join(gitclone_params)}"')
                     retval = subprocess.call(
                         gitclone_params, stdout=git_stdout, stderr=git_stderr
                     )
+                    if retval != 0 and gitclone_fallback_params is not None:
+                        self.logger.debug(
+                            f"Shallow clone of {repoURL} (tag {repoTag}) failed. Falling back to a full clone"
+                        )
+                        self.logger.debug(
+                            f'Running "{" ".join(gitclone_fallback_params)}"'
+                        )
+                        retval = subprocess.call(
+                            gitclone_fallback_params,
+                            stdout=git_stdout,
+                            stderr=git_stderr,
+                        )
+                # Or, fetch the updates
+                if gitfetch_params is not None:
+                    self.logger.debug(f'Running "{" ".join(gitfetch_params)}"')
+                    retval = subprocess.Popen(
+                        gitfetch_params,
+                        stdout=git_stdout,
+                        stderr=git_stderr,
+                        cwd=repo_tag_destdir,
+                    ).wait()
+                    if retval != 0:
+                        self.logger.debug(
+                            f"Fetch of {repoURL} (tag {repoTag}) failed. Falling back to pull"
+                        )
+                        gitcheckout_params = [
+                            self.git_cmd,
+                            "pull",
+                            "--recurse-submodules",
+                        ]
+                        if repoTag is not None:
+                            gitcheckout_params.extend(["origin", repoTag])
+                        retval = 0
                 # Then, checkout (which can be optional)
                 if retval == 0 and (gitcheckout_params is not None):
                     self.logger.debug(f'Running "{" ".join(gitcheckout_params)}"')
@@ -216,8 +641,10 @@ class GitFetcher(AbstractRepoFetcher):
                         stderr=git_stderr,
                         cwd=repo_tag_destdir,
                     ).wait()
-                # Last, submodule preparation
-                if retval == 0:
+                # Last, submodule preparation (when there are submodules)
+                if retval == 0 and os.path.exists(
+                    os.path.join(repo_tag_destdir, ".gitmodules")
+                ):
                     # Last, initialize submodules
                     gitsubmodule_params = [
                         self.git_cmd,
@@ -249,19 +676,25 @@ class GitFetcher(AbstractRepoFetcher):
                     raise FetcherException(errstr)
 
         # Last, we have to obtain the effective checkout
-        gitrevparse_params = [self.git_cmd, "rev-parse", "--verify", "HEAD"]
-
-        self.logger.debug(f'Running "{" ".join(gitrevparse_params)}"')
-        with subprocess.Popen(
-            gitrevparse_params,
-            stdout=subprocess.PIPE,
-            encoding="iso-8859-1",
-            cwd=repo_tag_destdir,
-        ) as revproc:
-            if revproc.stdout is not None:
-                repo_effective_checkout = cast(
-                    "RepoTag", revproc.stdout.read().rstrip()
-                )
+        repo_effective_checkout: "RepoTag"
+        if is_commit:
+            # which is already known when a commit sha was requested
+            assert repoTag is not None
+            repo_effective_checkout = repoTag
+        else:
+            # (read in-process, so no git subprocess is needed)
+            import dulwich.errors
+            import dulwich.repo
+
+            try:
+                with dulwich.repo.Repo(repo_tag_destdir) as repo:
+                    repo_effective_checkout = cast(
+                        "RepoTag", repo.head().decode("ascii")
+                    )
+            except (dulwich.errors.NotGitRepository, KeyError) as nge:
+                raise FetcherException(
+                    f"ERROR: Unable to obtain the effective checkout of '{repoURL}' (tag '{repoTag}') at {repo_tag_destdir}"
+                ) from nge
 
         repo_desc: "RepoDesc" = {
             "repo": repoURL,
@@ -281,7 +714,7 @@ class GitFetcher(AbstractRepoFetcher):
         cachedFilename: "AbsPath",
         secContext: "Optional[SecurityContextConfig]" = None,
     ) -> "ProtocolFetcherReturn":
-        parsedInputURL = parse.urlparse(remote_file)
+        parsedInputURL = _parse_url(remote_file)
 
         # These are the usual URIs which can be understood by pip
         # See https://pip.pypa.io/en/stable/cli/pip_install/#git
@@ -289,23 +722,27 @@ class GitFetcher(AbstractRepoFetcher):
             raise FetcherException(f"FIXME: Unhandled scheme {parsedInputURL.scheme}")
 
         if parsedInputURL.scheme == self.GITHUB_SCHEME:
-            gh_path_split = parsedInputURL.path.split("/")
-            gh_path_gh = [
-                gh_path_split[0],
+            # Single pass over the path: owner, repo, tag and subdirectory
+            gh_path_split = [
+                gh_part for gh_part in parsedInputURL.path.split("/") if gh_part
             ]
+            if len(gh_path_split) < 2:
+                raise FetcherException(
+                    f"Unable to find owner and repository in {remote_file}"
+                )
+
+            gh_path = f"{gh_path_split[0]}/{gh_path_split[1]}.git"
             fragment = ""
             if len(gh_path_split) > 2:
-                gh_path_gh.append(gh_path_split[1] + f".git@{gh_path_split[2]}")
+                gh_path += "@" + gh_path_split[2]
                 if len(gh_path_split) > 3:
                     fragment = f"subdirectory={'/'.join(gh_path_split[3:])}"
-            else:
-                gh_path_gh.append(gh_path_split[1] + ".git")
 
             redir_url = parse.urlunparse(
                 parse.ParseResult(
                     scheme=self.GIT_PROTO_PREFIX + "https",
                     netloc=GITHUB_NETLOC,
-                    path="/".join(gh_path_gh),
+                    path=gh_path,
                     params="",
                     query="",
                     fragment=fragment,
@@ -317,29 +754,16 @@ class GitFetcher(AbstractRepoFetcher):
             )
 
         # Getting the scheme git is going to understand
-        if len(parsedInputURL.scheme) >= len(self.GIT_PROTO_PREFIX):
-            gitScheme = parsedInputURL.scheme[len(self.GIT_PROTO_PREFIX) :]
-        else:
-            gitScheme = parsedInputURL.scheme
+        gitScheme = parsedInputURL.scheme
+        if gitScheme.startswith(self.GIT_PROTO_PREFIX):
+            gitScheme = gitScheme[len(self.GIT_PROTO_PREFIX) :]
 
         # Getting the tag or branch
         repoTag: "Optional[RepoTag]"
-        if "@" in parsedInputURL.path:
-            gitPath, repoTag = cast(
-                "Tuple[str, RepoTag]", tuple(parsedInputURL.path.split("@", 1))
-            )
-        else:
-            gitPath = parsedInputURL.path
-            repoTag = None
+        gitPath, repoTag = _split_repo_tag(parsedInputURL.path)
 
         # Getting the repoRelPath (if available)
-        if len(parsedInputURL.fragment) > 0:
-            frag_qs = parse.parse_qs(parsedInputURL.fragment)
-            subDirArr = frag_qs.get("subdirectory", [])
-            if len(subDirArr) > 0:
-                repoRelPath = subDirArr[0]
-        else:
-            repoRelPath = None
+        repoRelPath = _extract_subdirectory(parsedInputURL.fragment)
 
         # Now, reassemble the repoURL, to be used by git client
         repoURL = cast(
@@ -385,11 +809,71 @@ class GitFetcher(AbstractRepoFetcher):
             licences=None,
         )
 
+    def fetch_many(
+        self,
+        remote_files: "Sequence[URIType]",
+        cachedFilenames: "Sequence[AbsPath]",
+        secContexts: "Optional[Sequence[Optional[SecurityContextConfig]]]" = None,
+        max_workers: "Optional[int]" = None,
+    ) -> "Sequence[ProtocolFetcherReturn]":
+        """
+        Fetch several git URIs concurrently, as each one of them is
+        bound by the network. Results are returned in the same order
+        as the input URIs, and the first failure is propagated.
+
+        :param remote_files: The git URIs to fetch.
+        :param cachedFilenames: Where each one of them is materialized.
+        :param secContexts: Optional security contexts, one per URI.
+        :param max_workers: Size of the thread pool.
+        :return: The ProtocolFetcherReturn of each URI.
+        """
+        if len(cachedFilenames) != len(remote_files):
+            raise FetcherException(
+                f"Mismatched number of URIs ({len(remote_files)}) and destinations ({len(cachedFilenames)})"
+            )
 
-HEAD_LABEL = b"HEAD"
-REFS_HEADS_PREFIX = b"refs/heads/"
-REFS_TAGS_PREFIX = b"refs/tags/"
-GIT_SCHEMES = ["https", "git+https", "ssh", "git+ssh", "file", "git+file"]
+        if secContexts is None:
+            secContexts = [None] * len(remote_files)
+        elif len(secContexts) != len(remote_files):
+            raise FetcherException(
+                f"Mismatched number of URIs ({len(remote_files)}) and security contexts ({len(secContexts)})"
+            )
+
+        if len(remote_files) == 0:
+            return []
+
+        if max_workers is None:
+            max_workers = max(3, (os.cpu_count() or 2) * 3 // 4)
+
+        with concurrent.futures.ThreadPoolExecutor(
+            max_workers=min(max_workers, len(remote_files))
+        ) as executor:
+            return list(
+                executor.map(self.fetch, remote_files, cachedFilenames, secContexts)
+            )
+
+
+GIT_COMMIT_SHA_PAT: "Final[Pattern[str]]" = re.compile(r"[0-9a-f]{40}")
+
+GIT_SCHEMES: "Final[Tuple[str, ...]]" = (
+    "https",
+    "git+https",
+    "ssh",
+    "git+ssh",
+    "file",
+    "git+file",
+)
+
+# Single pass parser for the most common git URLs. Those URLs it is not
+# able to digest (other schemes, path params, etc...) go through urlparse
+GIT_URL_PAT: "Final[Pattern[str]]" = re.compile(
+    r"^(?P<scheme>(?i:git\+[a-z]+|git|ssh|https?|file))://"
+    r"(?P<netloc>[^/?#]*)"
+    r"(?P<path>[^?#;]*)"
+    r"(?:\?[^#]*)?"
+    r"(?:#(?P<fragment>.*))?$",
+    re.DOTALL,
+)
 
 
 def guess_git_repo_params(
@@ -399,7 +883,7 @@ def guess_git_repo_params(
 ) -> "Optional[RemoteRepo]":
     """Extract the parameters for a git repo from the given URL. If an invalid URL is passed,
     this function returns `None`.
-    
+
     The acceptable form for the URL can be found [here](https://pip.pypa.io/en/stable/topics/vcs-support/#git).
 
     :param wf_url: The URL to the repo.
@@ -409,44 +893,57 @@ def guess_git_repo_params(
     if no repo was found.
     """
     repoURL = None
-    repoTag = None
     repoRelPath = None
     repoType: "Optional[RepoType]" = RepoType.Git
     web_url: "Optional[URIType]" = None
 
     # Deciding which is the input
+    git_match = None
+    parsed_wf_url: "Optional[parse.ParseResult]"
     if isinstance(wf_url, parse.ParseResult):
         parsed_wf_url = wf_url
     else:
-        parsed_wf_url = parse.urlparse(wf_url)
-
-    # Return None if no scheme in URL. Can't choose how to proceed
-    if not parsed_wf_url.scheme:
-        logger.debug(
-            f"No scheme in repo URL. Choices are: {', '.join(GIT_SCHEMES)}"
-        )
-        return None
+        git_match = GIT_URL_PAT.match(wf_url)
+        parsed_wf_url = _parse_url(wf_url) if git_match is None else None
+
+    if git_match is not None:
+        scheme = git_match.group("scheme").lower()
+        netloc = git_match.group("netloc")
+        path = git_match.group("path")
+        fragment = git_match.group("fragment")
+    else:
+        assert parsed_wf_url is not None
+        # Return None if no scheme in URL. Can't choose how to proceed
+        if not parsed_wf_url.scheme:
+            logger.debug(
+                f"No scheme in repo URL. Choices are: {', '.join(GIT_SCHEMES)}"
+            )
+            return None
 
-    # Getting the scheme git is going to understand
-    git_scheme = parsed_wf_url.scheme.removeprefix("git+")
+        scheme = parsed_wf_url.scheme
+        netloc = parsed_wf_url.netloc
+        path = parsed_wf_url.path
+        fragment = parsed_wf_url.fragment
 
     # Getting the tag or branch
-    gitPath = parsed_wf_url.path
-    if "@" in parsed_wf_url.path:
-        gitPath, repoTag = parsed_wf_url.path.split("@", 1)
+    gitPath, repoTag = _split_repo_tag(path)
+
+    # Getting the scheme git is going to understand
+    git_scheme = scheme.removeprefix("git+")
 
     # Getting the repoRelPath (if available)
-    if parsed_wf_url.fragment:
-        frag_qs = parse.parse_qs(parsed_wf_url.fragment)
-        subDirArr = frag_qs.get("subdirectory", [])
-        if subDirArr:
-            repoRelPath = subDirArr[0]
+    repoRelPath = _extract_subdirectory(fragment)
 
     # Now, reassemble the repoURL
     if git_scheme == "ssh":
-        repoURL = parsed_wf_url.netloc + gitPath
+        repoURL = f"{netloc}{gitPath}"
+    elif parsed_wf_url is not None:
+        repoURL = parsed_wf_url._replace(
+            scheme=git_scheme, path=gitPath, params="", query="", fragment=""
+        ).geturl()
     else:
-        repoURL = parse.urlunparse((git_scheme, parsed_wf_url.netloc, gitPath, "", "", ""))
+        # The single pass parser only accepts schemes with network location
+        repoURL = f"{git_scheme}://{netloc}{gitPath}"
 
     logger.debug(
         "From {} was derived (type {}) {} {} {}".format(
@@ -456,7 +953,7 @@ def guess_git_repo_params(
 
     return RemoteRepo(
         repo_url=cast("RepoURL", repoURL),
-        tag=cast("Optional[RepoTag]", repoTag),
+        tag=repoTag,
         rel_path=cast("Optional[RelPath]", repoRelPath),
         repo_type=repoType,
         web_url=web_url,
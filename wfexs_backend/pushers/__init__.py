@@ -65,12 +65,8 @@ class AbstractExportPlugin(abc.ABC):
     def __init__(
         self, wfInstance: "WF", setup_block: "Optional[SecurityContextConfig]" = None
     ):
-        import inspect
-
         self.logger = logging.getLogger(
-            dict(inspect.getmembers(self))["__module__"]
-            + "::"
-            + self.__class__.__name__
+            self.__class__.__module__ + "::" + self.__class__.__name__
         )
         # This is used to resolve paths
         self.wfInstance = wfInstance
@@ -85,13 +85,9 @@ class NextcloudContentExporter:
         nextcloud_base_directory: "AbsPath",
         retention_tag_name: "Optional[str]" = None,
     ):
-        import inspect
-
         # Getting a logger focused on specific classes
         self.logger = logging.getLogger(
-            dict(inspect.getmembers(self))["__module__"]
-            + "::"
-            + self.__class__.__name__
+            self.__class__.__module__ + "::" + self.__class__.__name__
         )
 
         # This set is used to record the directories which have already
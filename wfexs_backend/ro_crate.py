@@ -17,22 +17,32 @@
 # limitations under the License.
 from __future__ import absolute_import
 
+import asyncio
+import concurrent.futures
 import copy
-import inspect
+import functools
+import hashlib
+import itertools
 import logging
+import operator
 import os
 import pathlib
+import stat
+import threading
 from typing import (
     cast,
     TYPE_CHECKING,
 )
 import warnings
+import zipfile
 
 if TYPE_CHECKING:
     import datetime
 
     from typing import (
         Any,
+        Callable,
+        IO,
         Mapping,
         MutableMapping,
         MutableSequence,
@@ -44,6 +54,7 @@ if TYPE_CHECKING:
 
     from typing_extensions import (
         Final,
+        TypeAlias,
     )
 
     from .common import (
@@ -74,10 +85,20 @@ if TYPE_CHECKING:
         WorkflowType,
     )
 
+    RepoEntrypointURLBuilder: TypeAlias = Callable[
+        [
+            "urllib.parse.ParseResult",
+            Sequence[str],
+            Optional[RepoTag],
+            Optional[RepoTag],
+            Optional[RelPath],
+        ],
+        str,
+    ]
+
 import urllib.parse
 import uuid
 
-import magic  # type: ignore[import]
 from rfc6920.methods import extract_digest
 import rocrate.model.entity  # type: ignore[import]
 import rocrate.model.dataset  # type: ignore[import]
@@ -92,8 +113,10 @@ import rocrate.rocrate  # type: ignore[import]
 from rocrate.utils import is_url  # type: ignore[import]
 
 from .utils.digests import (
+    BLAKE3_DIGEST_ALGORITHM,
     ComputeDigestFromDirectory,
-    ComputeDigestFromFile,
+    ComputeDigestFromFileLike,
+    DEFAULT_FILE_DIGEST_BUFFER_SIZE,
     hexDigest,
     unstringifyDigest,
 )
@@ -117,6 +140,329 @@ class ROCrateGenerationException(AbstractWfExSException):
     pass
 
 
+# URIs of contents which can be fetched (see the contentUrl usage)
+REMOTE_URI_PREFIXES: "Final[Tuple[str, ...]]" = (
+    "http://",
+    "https://",
+    "ftp://",
+    "ftps://",
+)
+
+# MIME types of the already seen contents, identified by their
+# digest and size, so libmagic is not run once and again over
+# the same container images or files, even from different crates
+MIME_CACHE_SIZE: "Final[int]" = 512
+_mime_cache: "MutableMapping[Tuple[str, int], str]" = {}
+# Crates can be built from several threads
+_mime_cache_lock = threading.Lock()
+
+
+# Each thread gets its own libmagic cookie, as python-magic serializes
+# all the calls on a shared cookie (files are scanned in thread pools)
+_magic_local = threading.local()
+
+
+def _thread_magic() -> "Any":
+    the_magic = getattr(_magic_local, "magic", None)
+    if the_magic is None:
+        # Imported here, as libmagic is only needed when crates are generated
+        import magic  # type: ignore[import]
+
+        the_magic = magic.Magic(mime=True)
+        _magic_local.magic = the_magic
+
+    return the_magic
+
+
+def _mime_from_file(
+    the_file: "Union[str, IO[bytes]]", the_signature: "str", the_size: "int"
+) -> "str":
+    """
+    The file can be either a path or an already open binary file
+    (positioned at its beginning), in order to avoid opening it again
+    """
+    mime_key = (the_signature, the_size)
+    the_mime = _mime_cache.get(mime_key)
+    if the_mime is None:
+        the_magic = _thread_magic()
+        if isinstance(the_file, str):
+            the_mime = the_magic.from_file(the_file)
+        else:
+            the_mime = the_magic.from_descriptor(the_file.fileno())
+        # Evicting the oldest entry, so the cache is bounded
+        with _mime_cache_lock:
+            if len(_mime_cache) >= MIME_CACHE_SIZE:
+                _mime_cache.pop(next(iter(_mime_cache)), None)
+            _mime_cache[mime_key] = the_mime
+
+    return the_mime
+
+
+def _github_entrypoint_url(
+    parsed_repo_url: "urllib.parse.ParseResult",
+    parsed_repo_path: "Sequence[str]",
+    repo_tag: "Optional[RepoTag]",
+    effective_checkout: "Optional[RepoTag]",
+    rel_path: "Optional[RelPath]",
+) -> "str":
+    assert effective_checkout is not None, "The effective checkout should be available"
+
+    # TODO: should we urldecode repo_name?
+    repo_name = parsed_repo_path[2]
+    if repo_name.endswith(".git"):
+        repo_name = repo_name[:-4]
+    wf_entrypoint_path = [
+        "",  # Needed to prepend a slash
+        parsed_repo_path[1],
+        # TODO: should we urlencode repo_name?
+        repo_name,
+        effective_checkout,
+    ]
+
+    if rel_path is not None:
+        wf_entrypoint_path.append(rel_path)
+
+    return urllib.parse.urlunparse(
+        (
+            "https",
+            "raw.githubusercontent.com",
+            "/".join(wf_entrypoint_path),
+            "",
+            "",
+            "",
+        )
+    )
+
+
+def _gitlab_entrypoint_url(
+    parsed_repo_url: "urllib.parse.ParseResult",
+    parsed_repo_path: "Sequence[str]",
+    repo_tag: "Optional[RepoTag]",
+    effective_checkout: "Optional[RepoTag]",
+    rel_path: "Optional[RelPath]",
+) -> "str":
+    # FIXME: cover the case of nested groups
+    repo_name = parsed_repo_path[2]
+    if repo_name.endswith(".git"):
+        repo_name = repo_name[:-4]
+    wf_entrypoint_path = [parsed_repo_path[1], repo_name]
+    if repo_tag is not None and rel_path is not None:
+        # TODO: should we urlencode repoTag?
+        wf_entrypoint_path.extend(["-", "raw", repo_tag, rel_path])
+
+    return urllib.parse.urlunparse(
+        (
+            parsed_repo_url.scheme,
+            parsed_repo_url.netloc,
+            "/".join(wf_entrypoint_path),
+            "",
+            "",
+            "",
+        )
+    )
+
+
+GITHUB_HOST_KIND: "Final[str]" = "github"
+GITLAB_HOST_KIND: "Final[str]" = "gitlab"
+
+
+def _repo_host_kind(netloc: "str") -> "Optional[str]":
+    if netloc == "github.com":
+        return GITHUB_HOST_KIND
+    if "gitlab" in netloc:
+        return GITLAB_HOST_KIND
+
+    return None
+
+
+# Builders of the raw URL of the workflow entrypoint,
+# depending on the kind of git forge
+_REPO_ENTRYPOINT_URL_BUILDERS: "Final[Mapping[Optional[str], RepoEntrypointURLBuilder]]" = {
+    GITHUB_HOST_KIND: _github_entrypoint_url,
+    GITLAB_HOST_KIND: _gitlab_entrypoint_url,
+}
+
+
+# The additional types of the scalar values. Boolean goes first,
+# as bool is a subclass of int
+SCALAR_ADDITIONAL_TYPES: "Final[Mapping[type, str]]" = {
+    bool: "Boolean",
+    int: "Integer",
+    str: "String",
+    float: "Float",
+}
+
+
+def _scalar_additional_type(value: "Any") -> "Optional[str]":
+    additional_type = SCALAR_ADDITIONAL_TYPES.get(type(value))
+    if additional_type is None:
+        # Subclasses of the scalar types are less common
+        for scalar_type, scalar_additional_type in SCALAR_ADDITIONAL_TYPES.items():
+            if isinstance(value, scalar_type):
+                return scalar_additional_type
+
+    return additional_type
+
+
+@functools.lru_cache(maxsize=64)
+def _lang_identifier(
+    uri_template: "str", langVersion: "Optional[Union[EngineVersion, WFLangVersion]]"
+) -> "str":
+    """
+    The same few workflow languages and versions are used by most crates
+    """
+    return uri_template.format(langVersion)
+
+
+@functools.lru_cache(maxsize=256)
+def _wf_folder_uuid(wf_entrypoint_url: "str") -> "str":
+    """
+    The folder of a workflow inside the crates is derived from its
+    entrypoint URL, which repeats when the same workflow is packed again
+    """
+    return str(uuid.uuid5(uuid.NAMESPACE_URL, wf_entrypoint_url))
+
+
+# Scans of the already seen files, identified by their inode and
+# modification time, so the same physical file reached through
+# different paths (hard links, bind mounts, secondary files, ...)
+# is hashed only once, even from different crates
+SCAN_CACHE_SIZE: "Final[int]" = 4096
+_inode_scan_cache: "MutableMapping[Tuple[int, int, int, int], Tuple[int, Fingerprint, str]]" = (
+    {}
+)
+_inode_scan_cache_lock = threading.Lock()
+
+
+def _scan_file(the_path: "str") -> "Tuple[int, Fingerprint, str]":
+    """
+    It computes the size, the sha256 digest and the MIME type of a file
+    in a single read pass, instead of stat'ing, hashing and sniffing it
+    separately
+    """
+    h = hashlib.sha256()
+    the_size = 0
+    with open(the_path, mode="rb", buffering=0) as fH:
+        the_stat = os.fstat(fH.fileno())
+        inode_key = (
+            the_stat.st_dev,
+            the_stat.st_ino,
+            the_stat.st_mtime_ns,
+            the_stat.st_size,
+        )
+        scanned = _inode_scan_cache.get(inode_key)
+        if scanned is not None:
+            return scanned
+
+        rbuf = bytearray(DEFAULT_FILE_DIGEST_BUFFER_SIZE)
+        rview = memoryview(rbuf)
+        readlen = fH.readinto(rbuf)
+        while readlen:
+            h.update(rview[:readlen])
+            the_size += readlen
+            readlen = fH.readinto(rbuf)
+
+        the_signature = cast("Fingerprint", h.hexdigest())
+        # The MIME type is sniffed from the already open descriptor,
+        # instead of opening the file again by its path. Empty files are
+        # the exception, as libmagic only tells inode/x-empty from paths
+        fH.seek(0)
+        scanned = (
+            the_size,
+            the_signature,
+            _mime_from_file(fH if the_size > 0 else the_path, the_signature, the_size),
+        )
+    # Evicting the oldest entry, so the cache is bounded
+    with _inode_scan_cache_lock:
+        if len(_inode_scan_cache) >= SCAN_CACHE_SIZE:
+            _inode_scan_cache.pop(next(iter(_inode_scan_cache)), None)
+        _inode_scan_cache[inode_key] = scanned
+
+    return scanned
+
+
+def _scan_or_sniff_file(
+    the_path: "str", the_signature: "Optional[Fingerprint]" = None
+) -> "Tuple[int, Fingerprint, str]":
+    """
+    When the sha256 digest of the file is already known, only
+    its size and MIME type are gathered
+    """
+    if the_signature is None:
+        return _scan_file(the_path)
+
+    the_size = os.stat(the_path).st_size
+    return (
+        the_size,
+        the_signature,
+        _mime_from_file(the_path, the_signature, the_size),
+    )
+
+
+def _scan_files(
+    the_paths: "Sequence[str]",
+    the_signatures: "Optional[Sequence[Optional[Fingerprint]]]" = None,
+    max_workers: "Optional[int]" = None,
+) -> "Mapping[str, Tuple[int, Fingerprint, str]]":
+    """
+    It gathers the sizes, sha256 digests and MIME types of a batch
+    of files, hashing them in a thread pool (hashlib releases the GIL)
+    """
+    if the_signatures is None:
+        the_signatures = [None] * len(the_paths)
+
+    if len(the_paths) <= 1:
+        return {
+            the_path: _scan_or_sniff_file(the_path, the_signature)
+            for the_path, the_signature in zip(the_paths, the_signatures)
+        }
+
+    if max_workers is None:
+        max_workers = max(3, (os.cpu_count() or 2) * 3 // 4)
+
+    with concurrent.futures.ThreadPoolExecutor(
+        max_workers=min(max_workers, len(the_paths))
+    ) as executor:
+        return dict(
+            zip(
+                the_paths,
+                executor.map(_scan_or_sniff_file, the_paths, the_signatures),
+            )
+        )
+
+
+def _stat_mode(the_path: "str") -> "int":
+    """
+    A single stat call, instead of os.path.isfile followed by
+    os.path.isdir. Unreachable paths get mode 0 (neither file nor dir)
+    """
+    try:
+        return os.stat(the_path).st_mode
+    except (OSError, ValueError):
+        return 0
+
+
+def _signature_algorithm_and_hex(
+    the_signature: "Fingerprint",
+) -> "Tuple[str, Fingerprint]":
+    """
+    It returns both the digest algorithm and the hexadecimal digest
+    of either an ni/nih URI or a stringified digest
+    """
+    digest, algo = extract_digest(the_signature)
+    if digest is None:
+        digest, algo = unstringifyDigest(the_signature)
+    # Signatures come from the workflows and the containers,
+    # so they are validated
+    if algo is None or digest is False:
+        raise ROCrateGenerationException(f"Invalid check digit in {the_signature}")
+    return algo, hexDigest(algo, digest)
+
+
+def _hex_signature(the_signature: "Fingerprint") -> "Fingerprint":
+    return _signature_algorithm_and_hex(the_signature)[1]
+
+
 class FormalParameter(rocrate.model.entity.Entity):  # type: ignore[misc]
     def __init__(
         self,
@@ -331,6 +677,42 @@ class FixedROCrate(rocrate.rocrate.ROCrate):  # type: ignore[misc]
 
     add_directory = add_dataset
 
+    # Bigger chunks than the rocrate-py default (8KiB)
+    ZIP_CHUNK_SIZE: "Final[int]" = 1024 * 1024
+
+    def write_zip(self, out_path: "AnyPath") -> "pathlib.Path":
+        """
+        Contents are stored (not deflated again) and streamed straight
+        to the zip file, as most of the attached scientific data
+        (BAM, CRAM, gzipped files, container images) is already compressed
+        """
+        the_out_path: "pathlib.Path" = pathlib.Path(out_path)
+        writable_entities = self.data_entities + self.default_entities
+
+        # Older rocrate-py releases cannot stream the entities, and
+        # crates read from a directory also have unlisted files
+        if self.source is not None or not all(
+            hasattr(writable_entity, "stream") for writable_entity in writable_entities
+        ):
+            return cast("pathlib.Path", super().write_zip(the_out_path))
+
+        # The entities are streamed as ROCrate._stream_zip does, but
+        # writing to the zip file without an in-memory buffer between
+        with zipfile.ZipFile(
+            the_out_path, mode="w", compression=zipfile.ZIP_STORED, allowZip64=True
+        ) as archive:
+            for writable_entity in writable_entities:
+                # Consecutive chunks belong to the same file
+                for path, path_chunks in itertools.groupby(
+                    writable_entity.stream(chunk_size=self.ZIP_CHUNK_SIZE),
+                    key=operator.itemgetter(0),
+                ):
+                    with archive.open(path, mode="w", force_zip64=True) as out_file:
+                        for _, chunk in path_chunks:
+                            out_file.write(chunk)
+
+        return the_out_path
+
 
 class WorkflowRunROCrate:
     """
@@ -340,9 +722,21 @@ class WorkflowRunROCrate:
     ContainerTypeIds: "Final[Mapping[ContainerType, str]]" = {
         ContainerType.Singularity: "https://apptainer.org/",
         ContainerType.Docker: "https://www.docker.com/",
-        ContainerType.Podman: "https://podman.io/"
+        ContainerType.Podman: "https://podman.io/",
     }
 
+    # Identifier, name and version of the profiles the crates conform to
+    WRROC_PROFILES: "Final[Sequence[Tuple[str, str, str]]]" = (
+        ("https://w3id.org/ro/wfrun/process/0.2", "ProcessRun Crate", "0.2"),
+        ("https://w3id.org/ro/wfrun/workflow/0.2", "Workflow Run Crate", "0.2"),
+        ("https://w3id.org/ro/wfrun/provenance/0.2", "Provenance Run Crate", "0.2"),
+        (
+            "https://w3id.org/workflowhub/workflow-ro-crate/1.0",
+            "Workflow RO-Crate",
+            "1.0",
+        ),
+    )
+
     def __init__(
         self,
         remote_repo: "RemoteRepo",
@@ -354,17 +748,31 @@ class WorkflowRunROCrate:
         arch: "Optional[ProcessorArchitecture]",
         staged_setup: "StagedSetup",
         payloads: "CratableItem" = NoCratableItem,
+        hash_non_attached: "bool" = True,
     ):
         # Getting a logger focused on specific classes
         self.logger = logging.getLogger(
-            dict(inspect.getmembers(self))["__module__"]
-            + "::"
-            + self.__class__.__name__
+            self.__class__.__module__ + "::" + self.__class__.__name__
         )
 
         self.cached_cts: "MutableMapping[ContainerType, rocrate.model.softwareapplication.SoftwareApplication]" = (
             {}
         )
+        # The same materialized file or directory can be referred
+        # several times (shared inputs, secondary files, etc...),
+        # so their entities are built (and their contents hashed) once
+        self._file_entity_cache: "MutableMapping[Tuple[str, str, bool, Optional[str], Optional[str]], FixedFile]" = (
+            {}
+        )
+        self._dataset_entity_cache: "MutableMapping[Tuple[str, str, bool, Optional[str], Optional[str]], Tuple[FixedDataset, Sequence[FixedFile]]]" = (
+            {}
+        )
+        self._formal_parameter_cache: "MutableMapping[str, FormalParameter]" = {}
+        self._dir_listing_cache: "MutableMapping[str, Sequence[Tuple[str, str, bool]]]" = (
+            {}
+        )
+        # Sizes, sha256 digests and MIME types of the files, by real path
+        self._scan_cache: "MutableMapping[str, Tuple[int, Fingerprint, str]]" = {}
 
         if localWorkflow.relPath is not None:
             wf_local_path = os.path.join(localWorkflow.dir, localWorkflow.relPath)
@@ -379,7 +787,15 @@ class WorkflowRunROCrate:
         assert staged_setup.inputs_dir is not None
         self.staged_setup = staged_setup
         self.work_dir = staged_setup.work_dir
+        # Most of the paths are inside the working directory, so
+        # their relative paths are obtained just stripping this prefix
+        self._work_dir_abs = os.path.abspath(self.work_dir)
+        self._work_dir_prefix = os.path.join(self._work_dir_abs, "")
         self.payloads = payloads
+        # When disabled, the contents of the files which are not attached
+        # to the crate are not read, so neither their digests nor their
+        # MIME types are recorded (only their sizes)
+        self.hash_non_attached = hash_non_attached
 
         self.crate: "FixedROCrate"
         self.compLang: "rocrate.model.computerlanguage.ComputerLanguage"
@@ -406,78 +822,45 @@ class WorkflowRunROCrate:
             wf_url = remote_repo.web_url
             wf_entrypoint_url = wf_url
         else:
-            wf_url = remote_repo.repo_url.replace(".git", "/")
+            # Only the suffix is removed, as ".git" can appear
+            # elsewhere (e.g. "https://github.com/owner/owner.github.io.git")
+            repo_url: "str" = remote_repo.repo_url
+            if repo_url.endswith(".git"):
+                repo_url = repo_url[:-4]
+            wf_url = repo_url.rstrip("/") + "/"
             if remote_repo.tag is not None:
                 wf_url += "tree/" + remote_repo.tag
             if localWorkflow.relPath is not None:
-                wf_url += localWorkflow.dir.rsplit("workflow")[1]
-
-            parsed_repo_url = urllib.parse.urlparse(remote_repo.repo_url)
-            if parsed_repo_url.netloc == "github.com":
-                assert (
-                    matWf.effectiveCheckout is not None
-                ), "The effective checkout should be available"
-
-                parsed_repo_path = parsed_repo_url.path.split("/")
-                repo_name = parsed_repo_path[2]
-                # TODO: should we urldecode repo_name?
-                if repo_name.endswith(".git"):
-                    repo_name = repo_name[:-4]
-                wf_entrypoint_path = [
-                    "",  # Needed to prepend a slash
-                    parsed_repo_path[1],
-                    # TODO: should we urlencode repo_name?
-                    repo_name,
-                    matWf.effectiveCheckout,
-                ]
-
-                if localWorkflow.relPath is not None:
-                    wf_entrypoint_path.append(localWorkflow.relPath)
-
-                wf_entrypoint_url = urllib.parse.urlunparse(
-                    (
-                        "https",
-                        "raw.githubusercontent.com",
-                        "/".join(wf_entrypoint_path),
-                        "",
-                        "",
-                        "",
-                    )
+                _, workflow_sep, workflow_subdir = localWorkflow.dir.rpartition(
+                    "workflow"
                 )
-
-            elif "gitlab" in parsed_repo_url.netloc:
-                parsed_repo_path = parsed_repo_url.path.split("/")
-                # FIXME: cover the case of nested groups
-                repo_name = parsed_repo_path[2]
-                if repo_name.endswith(".git"):
-                    repo_name = repo_name[:-4]
-                wf_entrypoint_path = [parsed_repo_path[1], repo_name]
-                if remote_repo.tag is not None and localWorkflow.relPath is not None:
-                    # TODO: should we urlencode repoTag?
-                    wf_entrypoint_path.extend(
-                        ["-", "raw", remote_repo.tag, localWorkflow.relPath]
+                if not workflow_sep:
+                    raise ROCrateGenerationException(
+                        f"Unable to derive the workflow URL, as {localWorkflow.dir} is not a workflow directory"
                     )
+                wf_url += workflow_subdir
 
-                wf_entrypoint_url = urllib.parse.urlunparse(
-                    (
-                        parsed_repo_url.scheme,
-                        parsed_repo_url.netloc,
-                        "/".join(wf_entrypoint_path),
-                        "",
-                        "",
-                        "",
-                    )
-                )
-
-            else:
+            parsed_repo_url = urllib.parse.urlparse(remote_repo.repo_url)
+            entrypoint_url_builder = _REPO_ENTRYPOINT_URL_BUILDERS.get(
+                _repo_host_kind(parsed_repo_url.netloc)
+            )
+            if entrypoint_url_builder is None:
                 raise ROCrateGenerationException(
                     "FIXME: Unsupported http(s) git repository {}".format(
                         remote_repo.repo_url
                     )
                 )
 
+            wf_entrypoint_url = entrypoint_url_builder(
+                parsed_repo_url,
+                parsed_repo_url.path.split("/"),
+                remote_repo.tag,
+                matWf.effectiveCheckout,
+                localWorkflow.relPath,
+            )
+
         # This is needed to avoid future collisions with other workflows stored in the RO-Crate
-        rocrate_wf_folder = str(uuid.uuid5(uuid.NAMESPACE_URL, wf_entrypoint_url))
+        rocrate_wf_folder = _wf_folder_uuid(wf_entrypoint_url)
 
         # TODO: research why relPathFiles is not populated in matWf
         lW = localWorkflow if matWf.relPathFiles is None else matWf
@@ -534,10 +917,25 @@ class WorkflowRunROCrate:
 
         rel_entities = []
         if lW.relPathFiles:
-            for rel_file in lW.relPathFiles:
-                # First, are we dealing with relative files or with URIs?
-                p_rel_file = urllib.parse.urlparse(rel_file)
-                if p_rel_file.scheme != "":
+            # First, are we dealing with relative files or with URIs?
+            # (there cannot be an URI scheme without a colon, so
+            # parsing is skipped for most of the relative paths)
+            rel_is_uri = [
+                ":" in rel_file and urllib.parse.urlparse(rel_file).scheme != ""
+                for rel_file in lW.relPathFiles
+            ]
+
+            # Then, sizes and digests of all the local files are gathered
+            # in a single batch, as hashing many files is faster in parallel
+            rel_paths = [
+                os.path.join(lW.dir, rel_file)
+                for rel_file, is_uri in zip(lW.relPathFiles, rel_is_uri)
+                if not is_uri and rocrate_wf_folder + "/" + rel_file != rocrate_wf_id
+            ]
+            rel_scans = _scan_files(rel_paths)
+
+            for rel_file, is_uri in zip(lW.relPathFiles, rel_is_uri):
+                if is_uri:
                     the_entity = rocrate.model.creativework.CreativeWork(
                         self.crate,
                         identifier=rel_file,
@@ -547,12 +945,17 @@ class WorkflowRunROCrate:
                 else:
                     rocrate_file_id = rocrate_wf_folder + "/" + rel_file
                     if rocrate_file_id != rocrate_wf_id:
+                        the_path = os.path.join(lW.dir, rel_file)
+                        the_size, the_signature, the_mime = rel_scans[the_path]
                         the_entity = self._add_file_to_crate(
-                            the_path=os.path.join(lW.dir, rel_file),
+                            the_path=the_path,
                             the_name=cast(
                                 "RelPath", os.path.join(rocrate_wf_folder, rel_file)
                             ),
                             the_uri=cast("URIType", rocrate_file_id),
+                            the_size=the_size,
+                            the_signature=the_signature,
+                            the_mime=the_mime,
                             do_attach=CratableItem.Workflow in payloads,
                         )
                         rel_entities.append(the_entity)
@@ -611,6 +1014,42 @@ class WorkflowRunROCrate:
         # for file_entry in include_files:
         #    self.crate.add_file(file_entry)
 
+    @classmethod
+    async def build_async(
+        cls,
+        remote_repo: "RemoteRepo",
+        localWorkflow: "LocalWorkflow",
+        materializedEngine: "MaterializedWorkflowEngine",
+        workflowEngineVersion: "Optional[WorkflowEngineVersionStr]",
+        containerEngineVersion: "Optional[ContainerEngineVersionStr]",
+        containerEngineOs: "Optional[ContainerOperatingSystem]",
+        arch: "Optional[ProcessorArchitecture]",
+        staged_setup: "StagedSetup",
+        payloads: "CratableItem" = NoCratableItem,
+        hash_non_attached: "bool" = True,
+    ) -> "WorkflowRunROCrate":
+        """
+        The initial crate is built in a worker thread, so an event loop
+        (i.e. a server) can keep attending other requests meanwhile
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            None,
+            functools.partial(
+                cls,
+                remote_repo,
+                localWorkflow,
+                materializedEngine,
+                workflowEngineVersion,
+                containerEngineVersion,
+                containerEngineOs,
+                arch,
+                staged_setup=staged_setup,
+                payloads=payloads,
+                hash_non_attached=hash_non_attached,
+            ),
+        )
+
     def _init_empty_crate_and_ComputerLanguage(
         self,
         wf_type: "WorkflowType",
@@ -629,7 +1068,9 @@ class WorkflowRunROCrate:
             properties={
                 "name": wf_type.name,
                 "alternateName": wf_type.trs_descriptor,
-                "identifier": {"@id": wf_type.uriTemplate.format(langVersion)},
+                "identifier": {
+                    "@id": _lang_identifier(wf_type.uriTemplate, langVersion)
+                },
                 "url": {"@id": wf_type.url},
                 "version": langVersion,
             },
@@ -644,24 +1085,10 @@ class WorkflowRunROCrate:
         wrroc_profiles = [
             rocrate.model.creativework.CreativeWork(
                 self.crate,
-                identifier="https://w3id.org/ro/wfrun/process/0.2",
-                properties={"name": "ProcessRun Crate", "version": "0.2"},
-            ),
-            rocrate.model.creativework.CreativeWork(
-                self.crate,
-                identifier="https://w3id.org/ro/wfrun/workflow/0.2",
-                properties={"name": "Workflow Run Crate", "version": "0.2"},
-            ),
-            rocrate.model.creativework.CreativeWork(
-                self.crate,
-                identifier="https://w3id.org/ro/wfrun/provenance/0.2",
-                properties={"name": "Provenance Run Crate", "version": "0.2"},
-            ),
-            rocrate.model.creativework.CreativeWork(
-                self.crate,
-                identifier="https://w3id.org/workflowhub/workflow-ro-crate/1.0",
-                properties={"name": "Workflow RO-Crate", "version": "1.0"},
-            ),
+                identifier=profile_id,
+                properties={"name": profile_name, "version": profile_version},
+            )
+            for profile_id, profile_name, profile_version in self.WRROC_PROFILES
         ]
         self.crate.add(*wrroc_profiles)
         self.crate.root_dataset.append_to("conformsTo", wrroc_profiles)
@@ -707,29 +1134,48 @@ class WorkflowRunROCrate:
                     self.cached_cts[container.type] = crate_cont_type
 
                 if do_attach and container.localPath is not None:
-                    the_size = os.stat(container.localPath).st_size
-                    assert container.signature is not None
-                    digest, algo = extract_digest(container.signature)
-                    if digest is None:
-                        digest, algo = unstringifyDigest(container.signature)
-                    assert algo is not None
-                    the_signature = hexDigest(algo, digest)
+                    # The (maybe huge) image is opened and stat'ed only once
+                    with open(container.localPath, mode="rb", buffering=0) as cH:
+                        the_size = os.fstat(cH.fileno()).st_size
+                        the_signature: "Fingerprint"
+                        the_blake3: "Optional[Fingerprint]" = None
+                        if container.signature is not None:
+                            algo, hex_signature = _signature_algorithm_and_hex(
+                                container.signature
+                            )
+                            if algo == BLAKE3_DIGEST_ALGORITHM:
+                                the_blake3 = hex_signature
+                            else:
+                                the_signature = hex_signature
+                        if container.signature is None or the_blake3 is not None:
+                            # Streamed in chunks, as images can be huge
+                            the_signature = cast(
+                                "Fingerprint",
+                                ComputeDigestFromFileLike(
+                                    cH,
+                                    bufferSize=DEFAULT_FILE_DIGEST_BUFFER_SIZE,
+                                    repMethod=hexDigest,
+                                ),
+                            )
+                            cH.seek(0)
+                        the_mime = _mime_from_file(cH, the_signature, the_size)
 
                     software_container = SoftwareContainer(
                         self.crate,
                         source=container.localPath,
-                        dest_path=os.path.relpath(container.localPath, self.work_dir),
+                        dest_path=self._relpath_in_work_dir(container.localPath),
                         fetch_remote=False,
                         validate_url=False,
                         properties={
                             "contentSize": the_size,
                             "identifier": container.taggedName,
                             "sha256": the_signature,
-                            "encodingFormat": magic.from_file(
-                                container.localPath, mime=True
-                            ),  # type: ignore[no-untyped-call]
+                            "encodingFormat": the_mime,
                         },
                     )
+                    # Keeping sha256 for the consumers which do not know BLAKE3
+                    if the_blake3 is not None:
+                        software_container["blake3"] = the_blake3
 
                 else:
                     container_pid = container.taggedName
@@ -770,22 +1216,29 @@ class WorkflowRunROCrate:
         crate_inputs = []
         do_attach = CratableItem.Inputs in self.payloads
         input_sep = "envvar" if are_envvars else "param"
+        # The prefix is the same for all the formal parameters
+        formal_parameter_id_prefix = f"{self.wf_file.id}#{input_sep}:"
+
+        # First, all the input files are scanned in parallel
+        in_paths: "MutableSequence[str]" = []
+        for in_item in inputs:
+            for itemInValue in in_item.values:
+                if isinstance(itemInValue, MaterializedContent):
+                    in_paths.append(itemInValue.local)
+            if isinstance(in_item.secondaryInputs, list):
+                in_paths.extend(secInput.local for secInput in in_item.secondaryInputs)
+        if do_attach or self.hash_non_attached:
+            self._prescan_files(in_paths)
+
         for in_item in inputs:
-            formal_parameter_id = (
-                f"{self.wf_file.id}#{input_sep}:"
-                + urllib.parse.quote(in_item.name, safe="")
+            formal_parameter_id = formal_parameter_id_prefix + urllib.parse.quote(
+                in_item.name, safe=""
             )
             itemInValue0 = in_item.values[0]
-            additional_type: "Optional[str]" = None
-            if isinstance(itemInValue0, int):
-                additional_type = "Integer"
-            elif isinstance(itemInValue0, str):
-                additional_type = "String"
-            elif isinstance(itemInValue0, bool):
-                additional_type = "Boolean"
-            elif isinstance(itemInValue0, float):
-                additional_type = "Float"
-            elif isinstance(itemInValue0, MaterializedContent):
+            additional_type = _scalar_additional_type(itemInValue0)
+            if additional_type is None and isinstance(
+                itemInValue0, MaterializedContent
+            ):
                 if len(in_item.values) > 1:
                     additional_type = "Collection"
                 elif itemInValue0.kind == ContentKind.File:
@@ -793,17 +1246,15 @@ class WorkflowRunROCrate:
                 elif itemInValue0.kind == ContentKind.Directory:
                     additional_type = "Dataset"
 
-            formal_parameter = FormalParameter(
-                self.crate,
+            # TODO: fix this at the standard level in some way
+            # so it is possible in the future to distinguish among
+            # inputs and environment variables in an standardized way
+            formal_parameter = self._add_formal_parameter(
                 name=in_item.name,
                 identifier=formal_parameter_id,
                 additional_type=additional_type,
+                wf_property="input",
             )
-            self.crate.add(formal_parameter)
-            # TODO: fix this at the standard level in some way
-            # so it is possible in the future to distinguish among
-            # inputs and environment variables in an standardized way
-            self.wf_file.append_to("input", formal_parameter)
 
             crate_coll: "Union[Collection, FixedDataset, FixedFile, PropertyValue, None]"
             if len(in_item.values) > 1:
@@ -818,14 +1269,15 @@ class WorkflowRunROCrate:
                     assert isinstance(itemInValues, MaterializedContent)
                     itemInLocalSource = itemInValues.local  # local source
                     itemInURISource = itemInValues.licensed_uri.uri  # uri source
-                    if os.path.isfile(itemInLocalSource):
+                    itemInMode = _stat_mode(itemInLocalSource)
+                    if stat.S_ISREG(itemInMode):
                         # This is needed to avoid including the input
                         crate_file = self._add_file_to_crate(
                             the_path=itemInLocalSource,
                             the_uri=itemInURISource,
                             the_name=cast(
                                 "RelPath",
-                                os.path.relpath(itemInLocalSource, self.work_dir),
+                                self._relpath_in_work_dir(itemInLocalSource),
                             ),
                             do_attach=do_attach,
                         )
@@ -835,13 +1287,13 @@ class WorkflowRunROCrate:
                         else:
                             crate_coll = crate_file
 
-                    elif os.path.isdir(itemInLocalSource):
+                    elif stat.S_ISDIR(itemInMode):
                         crate_dataset, _ = self._add_directory_as_dataset(
                             itemInLocalSource,
                             itemInURISource,
                             the_name=cast(
                                 "RelPath",
-                                os.path.relpath(itemInLocalSource, self.work_dir) + "/",
+                                self._relpath_in_work_dir(itemInLocalSource) + "/",
                             ),
                             do_attach=do_attach,
                         )
@@ -892,19 +1344,20 @@ class WorkflowRunROCrate:
 
                         secInputLocalSource = secInput.local  # local source
                         secInputURISource = secInput.licensed_uri.uri  # uri source
-                        if os.path.isfile(secInputLocalSource):
+                        secInputMode = _stat_mode(secInputLocalSource)
+                        if stat.S_ISREG(secInputMode):
                             # This is needed to avoid including the input
                             sec_crate_elem = self._add_file_to_crate(
                                 the_path=secInputLocalSource,
                                 the_uri=secInputURISource,
                                 the_name=cast(
                                     "RelPath",
-                                    os.path.relpath(secInputLocalSource, self.work_dir),
+                                    self._relpath_in_work_dir(secInputLocalSource),
                                 ),
                                 do_attach=do_attach,
                             )
 
-                        elif os.path.isdir(secInputLocalSource):
+                        elif stat.S_ISDIR(secInputMode):
                             sec_crate_elem, _ = self._add_directory_as_dataset(
                                 secInputLocalSource,
                                 secInputURISource,
@@ -916,8 +1369,8 @@ class WorkflowRunROCrate:
                             #    validate_url=False,
                             #    # properties=file_properties,
                             # )
-                            the_sec_name = os.path.relpath(
-                                secInputLocalSource, self.work_dir
+                            the_sec_name = self._relpath_in_work_dir(
+                                secInputLocalSource
                             )
 
                             if sec_crate_elem is not None:
@@ -938,6 +1391,94 @@ class WorkflowRunROCrate:
             # TODO digest other types of inputs
         return crate_inputs
 
+    def _add_formal_parameter(
+        self,
+        name: "str",
+        identifier: "str",
+        additional_type: "Optional[str]",
+        wf_property: "str",
+    ) -> "FormalParameter":
+        """
+        Each formal parameter is declared only once in the workflow,
+        even when several executions (or the expected outputs) refer to it
+        """
+        formal_parameter = self._formal_parameter_cache.get(identifier)
+        if formal_parameter is None:
+            formal_parameter = FormalParameter(
+                self.crate,
+                name=name,
+                identifier=identifier,
+                additional_type=additional_type,
+            )
+            self.crate.add(formal_parameter)
+            self.wf_file.append_to(wf_property, formal_parameter)
+            self._formal_parameter_cache[identifier] = formal_parameter
+        elif additional_type is not None:
+            # The latest known type prevails
+            formal_parameter["additionalType"] = additional_type
+
+        return formal_parameter
+
+    def _relpath_in_work_dir(self, the_path: "str") -> "str":
+        the_abs_path = os.path.abspath(the_path)
+        if the_abs_path.startswith(self._work_dir_prefix):
+            return the_abs_path[len(self._work_dir_prefix) :]
+
+        return os.path.relpath(the_abs_path, self._work_dir_abs)
+
+    def _prescan_files(
+        self,
+        the_paths: "Sequence[str]",
+        the_signatures: "Optional[Sequence[Optional[Fingerprint]]]" = None,
+    ) -> None:
+        """
+        The files are scanned in parallel before any entity is added
+        to the crate, as the crate itself cannot be shared among threads
+        """
+        if the_signatures is None:
+            the_signatures = [None] * len(the_paths)
+
+        pending_paths: "MutableSequence[str]" = []
+        pending_signatures: "MutableSequence[Optional[Fingerprint]]" = []
+        for the_path, the_signature in zip(the_paths, the_signatures):
+            real_path = os.path.realpath(the_path)
+            if real_path not in self._scan_cache and os.path.isfile(real_path):
+                pending_paths.append(real_path)
+                pending_signatures.append(the_signature)
+
+        if len(pending_paths) > 0:
+            self._scan_cache.update(_scan_files(pending_paths, pending_signatures))
+
+    def _prescan_generated_contents(
+        self,
+        the_contents: "Sequence[AbstractGeneratedContent]",
+    ) -> None:
+        the_paths: "MutableSequence[str]" = []
+        the_signatures: "MutableSequence[Optional[Fingerprint]]" = []
+        pending = list(the_contents)
+        while len(pending) > 0:
+            the_content = pending.pop()
+            # Only these ones have secondary files
+            if not isinstance(
+                the_content, (GeneratedContent, GeneratedDirectoryContent)
+            ):
+                continue
+
+            if isinstance(the_content, GeneratedContent):
+                the_paths.append(the_content.local)
+                the_signatures.append(
+                    None
+                    if the_content.signature is None
+                    else _hex_signature(the_content.signature)
+                )
+            elif isinstance(the_content.values, list):
+                pending.extend(the_content.values)
+
+            if isinstance(the_content.secondaryFiles, list):
+                pending.extend(the_content.secondaryFiles)
+
+        self._prescan_files(the_paths, the_signatures)
+
     def _add_file_to_crate(
         self,
         the_path: "str",
@@ -947,6 +1488,7 @@ class WorkflowRunROCrate:
         the_alternate_name: "Optional[RelPath]" = None,
         the_size: "Optional[int]" = None,
         the_signature: "Optional[Fingerprint]" = None,
+        the_mime: "Optional[str]" = None,
         do_attach: "bool" = True,
     ) -> "FixedFile":
         # The do_attach logic helps on the ill internal logic of add_file
@@ -961,13 +1503,25 @@ class WorkflowRunROCrate:
         if the_id is None:
             the_id = the_name if do_attach or (the_uri is None) else the_uri
 
+        real_path = os.path.realpath(the_path)
+        entity_key = (
+            real_path,
+            cast("str", the_id),
+            do_attach,
+            the_uri,
+            the_alternate_name,
+        )
+        cached_file_crate = self._file_entity_cache.get(entity_key)
+        if cached_file_crate is not None:
+            return cached_file_crate
+
         the_file_crate = self.crate.add_file(
             identifier=the_id,
             source=the_path if do_attach else None,
             dest_path=the_name if do_attach else None,
         )
         if do_attach and (the_uri is not None):
-            if the_uri.startswith("http") or the_uri.startswith("ftp"):
+            if the_uri.startswith(REMOTE_URI_PREFIXES):
                 # See https://github.com/ResearchObject/ro-crate/pull/259
                 uri_key = "contentUrl"
             else:
@@ -977,20 +1531,26 @@ class WorkflowRunROCrate:
         if the_alternate_name is not None:
             the_file_crate["alternateName"] = the_alternate_name
 
-        if the_size is None:
+        scanned = self._scan_cache.get(real_path)
+        if scanned is not None and the_signature in (None, scanned[1]):
+            the_size, the_signature, the_mime = scanned
+        elif the_signature is None and (do_attach or self.hash_non_attached):
+            # A single read pass, instead of stat + hash + libmagic
+            the_size, the_signature, the_mime = _scan_file(the_path)
+            self._scan_cache[real_path] = (the_size, the_signature, the_mime)
+        elif the_size is None:
             the_size = os.stat(the_path).st_size
-        if the_signature is None:
-            the_signature = cast(
-                "Fingerprint", ComputeDigestFromFile(the_path, repMethod=hexDigest)
-            )
         the_file_crate.append_to("contentSize", the_size, compact=True)
-        the_file_crate.append_to("sha256", the_signature, compact=True)
-        the_file_crate.append_to(
-            "encodingFormat",
-            magic.from_file(the_path, mime=True),  # type: ignore[no-untyped-call]
-            compact=True,
-        )
-
+        # When hash_non_attached is disabled, the contents of not attached
+        # files with unknown digest are not read, so neither their
+        # digest nor their MIME type are recorded
+        if the_signature is not None:
+            if the_mime is None:
+                the_mime = _mime_from_file(the_path, the_signature, the_size)
+            the_file_crate.append_to("sha256", the_signature, compact=True)
+            the_file_crate.append_to("encodingFormat", the_mime, compact=True)
+
+        self._file_entity_cache[entity_key] = the_file_crate
         return the_file_crate
 
     def _add_collection_to_crate(
@@ -1002,7 +1562,7 @@ class WorkflowRunROCrate:
 
         return wf_coll
 
-    def _add_directory_as_dataset(
+    def _add_dataset_entity(
         self,
         the_path: "str",
         the_uri: "URIType",
@@ -1010,14 +1570,7 @@ class WorkflowRunROCrate:
         the_name: "Optional[RelPath]" = None,
         the_alternate_name: "Optional[RelPath]" = None,
         do_attach: "bool" = True,
-    ) -> "Union[Tuple[FixedDataset, Sequence[FixedFile]], Tuple[None, None]]":
-        # FUTURE IMPROVEMENT
-        # Describe datasets referred from DOIs
-        # as in https://github.com/ResearchObject/ro-crate/pull/255/files
-
-        if not os.path.isdir(the_path):
-            return None, None
-
+    ) -> "FixedDataset":
         assert not do_attach or (
             the_name is not None
         ), "A name must be provided for local directories"
@@ -1026,7 +1579,6 @@ class WorkflowRunROCrate:
         if the_id is None:
             the_id = the_name if do_attach or (the_uri is None) else the_uri
 
-        the_files_crates: "MutableSequence[FixedFile]" = []
         crate_dataset = self.crate.add_dataset(
             identifier=the_id,
             source=the_path if do_attach else None,
@@ -1036,7 +1588,7 @@ class WorkflowRunROCrate:
             # properties=file_properties,
         )
         if do_attach and (the_uri is not None):
-            if the_uri.startswith("http") or the_uri.startswith("ftp"):
+            if the_uri.startswith(REMOTE_URI_PREFIXES):
                 # See https://github.com/ResearchObject/ro-crate/pull/259
                 uri_key = "contentUrl"
             else:
@@ -1046,55 +1598,156 @@ class WorkflowRunROCrate:
         if the_alternate_name is not None:
             crate_dataset["alternateName"] = the_alternate_name
 
-        # Now, recursively walk it
-        with os.scandir(the_path) as the_dir:
-            for the_file in the_dir:
-                if the_file.name[0] == ".":
-                    continue
+        return crate_dataset
+
+    def _list_dir(self, dir_path: "str") -> "Sequence[Tuple[str, str, bool]]":
+        """
+        It returns the name, path and whether it is a file (otherwise,
+        a directory) of the visible entries. Listings are kept, as the
+        same trees can be walked several times (e.g. inputs and their
+        secondary inputs)
+        """
+        dir_key = os.path.abspath(dir_path)
+        listing = self._dir_listing_cache.get(dir_key)
+        if listing is None:
+            new_listing: "MutableSequence[Tuple[str, str, bool]]" = []
+            with os.scandir(dir_path) as the_dir:
+                for the_file in the_dir:
+                    if the_file.name[0] == ".":
+                        continue
+                    # is_file and is_dir answers are cached by the DirEntry,
+                    # and the size is measured later, when the file entity
+                    # is built (either while hashing it or with a single stat)
+                    if the_file.is_file():
+                        new_listing.append((the_file.name, the_file.path, True))
+                    elif the_file.is_dir():
+                        new_listing.append((the_file.name, the_file.path, False))
+            listing = new_listing
+            self._dir_listing_cache[dir_key] = listing
+
+        return listing
+
+    def _add_directory_as_dataset(
+        self,
+        the_path: "str",
+        the_uri: "URIType",
+        the_id: "Optional[str]" = None,
+        the_name: "Optional[RelPath]" = None,
+        the_alternate_name: "Optional[RelPath]" = None,
+        do_attach: "bool" = True,
+    ) -> "Union[Tuple[FixedDataset, Sequence[FixedFile]], Tuple[None, None]]":
+        # FUTURE IMPROVEMENT
+        # Describe datasets referred from DOIs
+        # as in https://github.com/ResearchObject/ro-crate/pull/255/files
+
+        if not os.path.isdir(the_path):
+            return None, None
+
+        assert not do_attach or (
+            the_name is not None
+        ), "A name must be provided for local directories"
+
+        # When the id is none and ...
+        if the_id is None:
+            the_id = the_name if do_attach or (the_uri is None) else the_uri
+
+        entity_key = (
+            os.path.realpath(the_path),
+            cast("str", the_id),
+            do_attach,
+            the_uri,
+            the_alternate_name,
+        )
+        cached_dataset = self._dataset_entity_cache.get(entity_key)
+        if cached_dataset is not None:
+            return cached_dataset
+
+        crate_dataset = self._add_dataset_entity(
+            the_path,
+            the_uri,
+            the_id=the_id,
+            the_name=the_name,
+            the_alternate_name=the_alternate_name,
+            do_attach=do_attach,
+        )
+
+        # Now, iteratively walk it (breadth first). The parts of each
+        # directory are its files and the indexes of its subdirectories
+        # in the walk, which are resolved once all of them are known
+        walked_dirs: "MutableSequence[Tuple[str, URIType, FixedDataset]]" = [
+            (the_path, the_uri, crate_dataset)
+        ]
+        walked_parts: "MutableSequence[MutableSequence[Union[FixedFile, int]]]" = []
+        i_dir = 0
+        while i_dir < len(walked_dirs):
+            dir_path, dir_uri, _ = walked_dirs[i_dir]
+            # Shared by all the entries in the directory
+            dir_uri_prefix = dir_uri + "/"
+            dir_parts: "MutableSequence[Union[FixedFile, int]]" = []
+            for entry_name, entry_path, entry_is_file in self._list_dir(dir_path):
                 the_item_uri = cast(
                     "URIType",
-                    the_uri + "/" + urllib.parse.quote(the_file.name, safe=""),
+                    dir_uri_prefix + urllib.parse.quote(entry_name, safe=""),
                 )
-                if the_file.is_file():
-                    the_file_crate = self._add_file_to_crate(
-                        the_path=the_file.path,
-                        the_uri=the_item_uri,
-                        the_size=the_file.stat().st_size,
-                        do_attach=do_attach,
+                if entry_is_file:
+                    dir_parts.append(
+                        self._add_file_to_crate(
+                            the_path=entry_path,
+                            the_uri=the_item_uri,
+                            do_attach=do_attach,
+                        )
                     )
-
-                    crate_dataset.append_to("hasPart", the_file_crate)
-
-                    the_files_crates.append(the_file_crate)
-                elif the_file.is_dir():
+                else:
                     # TODO: fix URI handling
-                    (
-                        the_dir_crate,
-                        the_subfiles_crates,
-                    ) = self._add_directory_as_dataset(
-                        the_path=the_file.path,
-                        the_uri=the_item_uri,
-                        do_attach=do_attach,
+                    dir_parts.append(len(walked_dirs))
+                    walked_dirs.append(
+                        (
+                            entry_path,
+                            the_item_uri,
+                            self._add_dataset_entity(
+                                entry_path,
+                                the_item_uri,
+                                do_attach=do_attach,
+                            ),
+                        )
                     )
-                    if the_dir_crate is not None:
-                        assert the_subfiles_crates is not None
-                        crate_dataset.append_to("hasPart", the_dir_crate)
-                        crate_dataset.append_to("hasPart", the_subfiles_crates)
+            walked_parts.append(dir_parts)
+            i_dir += 1
+
+        # Subdirectories are always walked after their parents, so
+        # resolving in reverse order has their files ready. The
+        # files of a subdirectory are also parts of all its ancestors
+        walked_files: "MutableSequence[Sequence[FixedFile]]" = [[]] * len(walked_dirs)
+        for i_dir in range(len(walked_dirs) - 1, -1, -1):
+            has_part: "MutableSequence[Union[FixedFile, FixedDataset]]" = []
+            the_files_crates: "MutableSequence[FixedFile]" = []
+            for dir_part in walked_parts[i_dir]:
+                if isinstance(dir_part, int):
+                    has_part.append(walked_dirs[dir_part][2])
+                    has_part.extend(walked_files[dir_part])
+                    the_files_crates.extend(walked_files[dir_part])
+                else:
+                    has_part.append(dir_part)
+                    the_files_crates.append(dir_part)
 
-                        the_files_crates.extend(the_subfiles_crates)
+            # A single bulk addition per directory
+            if len(has_part) > 0:
+                walked_dirs[i_dir][2].append_to("hasPart", has_part)
+            walked_files[i_dir] = the_files_crates
 
-        return crate_dataset, the_files_crates
+        self._dataset_entity_cache[entity_key] = (crate_dataset, walked_files[0])
+        return crate_dataset, walked_files[0]
 
     def addWorkflowExpectedOutputs(
         self,
         outputs: "Sequence[ExpectedOutput]",
     ) -> None:
+        formal_parameter_id_prefix = self.wf_file.id + "#output:"
         for out_item in outputs:
-            formal_parameter_id = (
-                self.wf_file.id
-                + "#output:"
-                + urllib.parse.quote(out_item.name, safe="")
+            formal_parameter_id = formal_parameter_id_prefix + urllib.parse.quote(
+                out_item.name, safe=""
             )
+            additional_type: "Optional[str]"
             if out_item.kind == ContentKind.File:
                 additional_type = "File"
             elif out_item.kind == ContentKind.Directory:
@@ -1102,14 +1755,12 @@ class WorkflowRunROCrate:
             else:
                 additional_type = None
 
-            formal_parameter = FormalParameter(
-                self.crate,
+            formal_parameter = self._add_formal_parameter(
                 name=out_item.name,
                 identifier=formal_parameter_id,
                 additional_type=additional_type,
+                wf_property="output",
             )
-            self.crate.add(formal_parameter)
-            self.wf_file.append_to("output", formal_parameter)
 
     def writeWRROC(self, filename: "AnyPath") -> None:
         with warnings.catch_warnings():
@@ -1121,6 +1772,15 @@ class WorkflowRunROCrate:
                 )
             self.crate.write_zip(filename)
 
+    async def writeWRROC_async(self, filename: "AnyPath") -> None:
+        """
+        The zip is written in a worker thread, so an event loop
+        (i.e. a server) can keep attending other requests meanwhile.
+        The crate must not be modified until it is awaited
+        """
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, self.writeWRROC, filename)
+
     def addWorkflowExecution(
         self,
         stagedExec: "StagedExecution",
@@ -1196,12 +1856,26 @@ class WorkflowRunROCrate:
         """
         do_attach = CratableItem.Outputs in self.payloads
         crate_outputs: "MutableSequence[rocrate.model.entity.Entity]" = []
+        formal_parameter_id_prefix = self.wf_file.id + "#output:"
+
+        # First, all the output files are sniffed in parallel
+        if do_attach or self.hash_non_attached:
+            self._prescan_generated_contents(
+                [
+                    out_value
+                    for out_item in outputs
+                    if out_item.kind in (ContentKind.File, ContentKind.Directory)
+                    for out_value in cast(
+                        "Sequence[AbstractGeneratedContent]", out_item.values
+                    )
+                ]
+            )
+
         for out_item in outputs:
-            formal_parameter_id = (
-                self.wf_file.id
-                + "#output:"
-                + urllib.parse.quote(out_item.name, safe="")
+            formal_parameter_id = formal_parameter_id_prefix + urllib.parse.quote(
+                out_item.name, safe=""
             )
+            additional_type: "Optional[str]"
             if out_item.kind == ContentKind.File:
                 additional_type = "Collection" if len(out_item.values) > 1 else "File"
             elif out_item.kind == ContentKind.Directory:
@@ -1209,26 +1883,16 @@ class WorkflowRunROCrate:
                     "Collection" if len(out_item.values) > 1 else "Dataset"
                 )
             elif len(out_item.values) > 0:
-                itemOutValue0 = out_item.values[0]
-                if isinstance(itemOutValue0, int):
-                    additional_type = "Integer"
-                elif isinstance(itemOutValue0, str):
-                    additional_type = "String"
-                elif isinstance(itemOutValue0, bool):
-                    additional_type = "Boolean"
-                elif isinstance(itemOutValue0, float):
-                    additional_type = "Float"
+                additional_type = _scalar_additional_type(out_item.values[0])
             else:
                 additional_type = None
 
-            formal_parameter = FormalParameter(
-                self.crate,
+            formal_parameter = self._add_formal_parameter(
                 name=out_item.name,
                 identifier=formal_parameter_id,
                 additional_type=additional_type,
+                wf_property="output",
             )
-            self.crate.add(formal_parameter)
-            self.wf_file.append_to("output", formal_parameter)
 
             # This can happen when there is no output, like when a workflow has failed
             if len(out_item.values) == 0:
@@ -1327,11 +1991,7 @@ class WorkflowRunROCrate:
     ) -> "Union[FixedFile, Collection]":
         assert the_content.signature is not None
 
-        digest, algo = extract_digest(the_content.signature)
-        if digest is None:
-            digest, algo = unstringifyDigest(the_content.signature)
-        assert algo is not None
-        dest_path = os.path.relpath(the_content.local, self.work_dir)
+        dest_path = self._relpath_in_work_dir(the_content.local)
         # dest_path = hexDigest(algo, digest)
 
         alternateName = os.path.relpath(
@@ -1348,7 +2008,7 @@ class WorkflowRunROCrate:
             the_uri=the_content_uri,
             the_name=cast("RelPath", dest_path),
             the_alternate_name=cast("RelPath", alternateName),
-            the_signature=hexDigest(algo, digest),
+            the_signature=_hex_signature(the_content.signature),
             do_attach=do_attach,
         )
 
@@ -1393,7 +2053,7 @@ class WorkflowRunROCrate:
             the_files_crates: "MutableSequence[FixedFile]" = []
 
             the_uri = the_content.uri.uri if the_content.uri is not None else None
-            dest_path = os.path.relpath(the_content.local, self.work_dir) + "/"
+            dest_path = self._relpath_in_work_dir(the_content.local) + "/"
             if do_attach or (the_uri is None):
                 the_id = dest_path
             else:
@@ -1417,7 +2077,7 @@ class WorkflowRunROCrate:
             )
 
             if do_attach and (the_uri is not None):
-                if the_uri.startswith("http") or the_uri.startswith("ftp"):
+                if the_uri.startswith(REMOTE_URI_PREFIXES):
                     # See https://github.com/ResearchObject/ro-crate/pull/259
                     uri_key = "contentUrl"
                 else:
@@ -1433,6 +2093,8 @@ class WorkflowRunROCrate:
             crate_dataset["alternateName"] = alternateName
 
             if isinstance(the_content.values, list):
+                # All the parts are appended at once
+                has_part: "MutableSequence[rocrate.model.entity.Entity]" = []
                 for the_val in the_content.values:
                     if isinstance(the_val, GeneratedContent):
                         the_val_file = self._add_GeneratedContent_to_crate(
@@ -1440,7 +2102,7 @@ class WorkflowRunROCrate:
                             rel_work_dir=rel_work_dir,
                             do_attach=do_attach,
                         )
-                        crate_dataset.append_to("hasPart", the_val_file)
+                        has_part.append(the_val_file)
                         the_files_crates.append(the_val_file)
                     elif isinstance(the_val, GeneratedDirectoryContent):
                         (
@@ -1453,11 +2115,14 @@ class WorkflowRunROCrate:
                         )
                         if the_val_dataset is not None:
                             assert the_subfiles_crates is not None
-                            crate_dataset.append_to("hasPart", the_val_dataset)
-                            crate_dataset.append_to("hasPart", the_subfiles_crates)
+                            has_part.append(the_val_dataset)
+                            has_part.extend(the_subfiles_crates)
 
                             the_files_crates.extend(the_subfiles_crates)
 
+                if len(has_part) > 0:
+                    crate_dataset.append_to("hasPart", has_part)
+
             # The very corner case of output directories with secondary files
             if (
                 isinstance(the_content.secondaryFiles, list)
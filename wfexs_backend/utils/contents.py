@@ -18,9 +18,11 @@
 
 from __future__ import absolute_import
 
+import errno
 import logging
 import os
 import shutil
+import stat
 from typing import (
     cast,
     TYPE_CHECKING,
@@ -32,9 +34,17 @@ from ..common import (
     GeneratedDirectoryContent,
 )
 
+# fcntl is not available on every platform (e.g. Windows),
+# so reflinks are not tried there
+try:
+    import fcntl
+except ImportError:
+    fcntl = None  # type: ignore[assignment]
+
 if TYPE_CHECKING:
     from typing import (
         Any,
+        IO,
         Mapping,
         MutableSequence,
         Optional,
@@ -42,6 +52,10 @@ if TYPE_CHECKING:
         Union,
     )
 
+    from typing_extensions import (
+        Final,
+    )
+
     from ..common import (
         AbsPath,
         AbstractGeneratedContent,
@@ -226,8 +240,90 @@ def CWLDesc2Content(
     return matValues
 
 
+# Request number of the Linux ioctl which clones a whole file
+# (from linux/fs.h)
+FICLONE: "Final[int]" = 0x40049409
+
+# Size of each copy_file_range call
+COPY_FILE_RANGE_CHUNK: "Final[int]" = 1024 * 1024
+
+
+def _copy_file_range(src_H: "IO[bytes]", dest_H: "IO[bytes]") -> "Optional[int]":
+    """
+    In-kernel copy, which avoids moving the contents through
+    user space. It returns the number of copied bytes, or None
+    when the copy could not be done.
+    """
+    copy_file_range = getattr(os, "copy_file_range", None)
+    if copy_file_range is None:
+        return None
+
+    src_fd = src_H.fileno()
+    dest_fd = dest_H.fileno()
+    copied = 0
+    try:
+        while True:
+            chunk_copied = copy_file_range(src_fd, dest_fd, COPY_FILE_RANGE_CHUNK)
+            if chunk_copied <= 0:
+                break
+            copied += chunk_copied
+    except OSError:
+        # Unsupported by the kernel or the filesystems
+        return None
+
+    return copied
+
+
+def copy2_reflink(src: "str", dest: "str", follow_symlinks: "bool" = True) -> "str":
+    """
+    A drop-in replacement of shutil.copy2, which first tries cheaper
+    ways to copy the contents: a copy-on-write clone (reflink) on
+    filesystems supporting it (Btrfs, XFS, ...), then an in-kernel
+    copy_file_range, and last a plain copy.
+    """
+    if os.path.isdir(dest):
+        dest = os.path.join(dest, os.path.basename(src))
+
+    if not follow_symlinks and os.path.islink(src):
+        return cast("str", shutil.copy2(src, dest, follow_symlinks=False))
+
+    # FIFOs, devices and so are left to shutil, as opening them
+    # could block, and their contents are not cloneable
+    src_stat = os.stat(src)
+    if not stat.S_ISREG(src_stat.st_mode):
+        return cast("str", shutil.copy2(src, dest, follow_symlinks=follow_symlinks))
+
+    copied = False
+    try:
+        with open(src, mode="rb") as src_H, open(dest, mode="wb") as dest_H:
+            if fcntl is not None:
+                try:
+                    fcntl.ioctl(dest_H.fileno(), FICLONE, src_H.fileno())
+                    copied = True
+                except OSError:
+                    pass
+            if not copied:
+                # Some files (e.g. the ones from procfs) report a size
+                # (usually 0) which does not match their contents, so
+                # the copy is only trusted when all the bytes were copied
+                copied = (
+                    src_stat.st_size > 0
+                    and _copy_file_range(src_H, dest_H) == src_stat.st_size
+                )
+    except OSError as ose:
+        # Unreadable files are left to shutil
+        if ose.errno not in (errno.EACCES, errno.EPERM):
+            raise
+
+    if copied:
+        shutil.copystat(src, dest, follow_symlinks=follow_symlinks)
+        return dest
+
+    return cast("str", shutil.copy2(src, dest, follow_symlinks=follow_symlinks))
+
+
 def copy2_nofollow(src: "str", dest: "str") -> "None":
-    shutil.copy2(src, dest, follow_symlinks=False)
+    copy2_reflink(src, dest, follow_symlinks=False)
 
 
 def link_or_copy(src: "AnyPath", dest: "AnyPath", force_copy: "bool" = False) -> None:
@@ -302,7 +398,7 @@ def link_or_copy(src: "AnyPath", dest: "AnyPath", force_copy: "bool" = False) ->
             # as it is in a separated filesystem
             if dest_exists:
                 os.unlink(dest)
-            shutil.copy2(src, dest)
+            copy2_reflink(src, dest)
         else:
             # Recursively copying the content
             # as it is in a separated filesystem
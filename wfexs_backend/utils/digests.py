@@ -63,14 +63,21 @@ if TYPE_CHECKING:
 
 
 from ..common import (
+    AbstractWfExSException,
     scantree,
     GeneratedContent,
 )
 
 
+class DigestAlgorithmUnavailableException(AbstractWfExSException):
+    pass
+
+
 # Next methods have been borrowed from FlowMaps
 DEFAULT_DIGEST_ALGORITHM = "sha256"
 DEFAULT_DIGEST_BUFFER_SIZE = 65536
+# Files (like container images) can be huge, so bigger reads pay off
+DEFAULT_FILE_DIGEST_BUFFER_SIZE = 1024 * 1024
 
 
 def stringifyDigest(digestAlgorithm: "str", digest: "bytes") -> "Fingerprint":
@@ -130,6 +137,26 @@ def nihDigester(digestAlgorithm: "str", digest: "bytes") -> "Fingerprint":
     return cast("Fingerprint", generate_nih_from_digest(digest, algo=digestAlgorithm))
 
 
+BLAKE3_DIGEST_ALGORITHM = "blake3"
+
+
+def _new_hasher(digestAlgorithm: "str") -> "Any":
+    if digestAlgorithm == BLAKE3_DIGEST_ALGORITHM:
+        # Optional dependency (the blake3 extra), only needed when
+        # BLAKE3 is requested. Its tree hashing can use several threads
+        # on huge files
+        try:
+            import blake3  # type: ignore[import-not-found]
+        except ImportError as ie:
+            raise DigestAlgorithmUnavailableException(
+                f"Digest algorithm {digestAlgorithm} needs the optional blake3 module (install it with pip install blake3)"
+            ) from ie
+
+        return blake3.blake3(max_threads=blake3.blake3.AUTO)
+
+    return hashlib.new(digestAlgorithm)
+
+
 def ComputeDigestFromObject(
     obj: "Any",
     digestAlgorithm: "str" = DEFAULT_DIGEST_ALGORITHM,
@@ -138,7 +165,7 @@ def ComputeDigestFromObject(
     """
     Accessory method used to compute the digest of an input file-like object
     """
-    h = hashlib.new(digestAlgorithm)
+    h = _new_hasher(digestAlgorithm)
     h.update(json.dumps(obj, sort_keys=True).encode("utf-8"))
 
     return repMethod(digestAlgorithm, h.digest())
@@ -153,11 +180,22 @@ def ComputeDigestFromFileLike(
     """
     Accessory method used to compute the digest of an input file-like object
     """
-    h = hashlib.new(digestAlgorithm)
-    buf = filelike.read(bufferSize)
-    while len(buf) > 0:
-        h.update(buf)
+    h = _new_hasher(digestAlgorithm)
+    readinto = getattr(filelike, "readinto", None)
+    if readinto is None:
         buf = filelike.read(bufferSize)
+        while len(buf) > 0:
+            h.update(buf)
+            buf = filelike.read(bufferSize)
+    else:
+        # The same buffer is reused on each read, so there is
+        # no allocation per chunk
+        rbuf = bytearray(bufferSize)
+        rview = memoryview(rbuf)
+        readlen = readinto(rbuf)
+        while readlen:
+            h.update(rview[:readlen])
+            readlen = readinto(rbuf)
 
     return repMethod(digestAlgorithm, h.digest())
 
@@ -166,7 +204,7 @@ def ComputeDigestFromFileLike(
 def ComputeDigestFromFile(
     filename: "AnyPath",
     digestAlgorithm: "str" = DEFAULT_DIGEST_ALGORITHM,
-    bufferSize: "int" = DEFAULT_DIGEST_BUFFER_SIZE,
+    bufferSize: "int" = DEFAULT_FILE_DIGEST_BUFFER_SIZE,
     repMethod: "Union[FingerprintMethod, RawFingerprintMethod]" = stringifyDigest,
 ) -> "Optional[Union[Fingerprint, bytes]]":
     """
@@ -177,7 +215,8 @@ def ComputeDigestFromFile(
     if repMethod is None:
         return None
 
-    with open(filename, mode="rb") as f:
+    # Unbuffered, as reads are already done in big chunks
+    with open(filename, mode="rb", buffering=0) as f:
         return ComputeDigestFromFileLike(f, digestAlgorithm, bufferSize, repMethod)
 
 
@@ -319,7 +358,7 @@ def ComputeDigestFromDirectory(
     cEntries = sorted(cEntries, key=lambda e: e[0])
 
     # Third, digest compute
-    h = hashlib.new(digestAlgorithm)
+    h = _new_hasher(digestAlgorithm)
     for cRelPathB, cDigest in cEntries:
         h.update(cRelPathB)
         h.update(cDigest)
@@ -358,7 +397,7 @@ def ComputeDigestFromGeneratedContentList(
     cEntries = sorted(cEntries, key=lambda e: e[0])
 
     # Third, digest compute
-    h = hashlib.new(digestAlgorithm)
+    h = _new_hasher(digestAlgorithm)
     for cRelPathB, cDigest in cEntries:
         h.update(cRelPathB)
         h.update(cDigest)
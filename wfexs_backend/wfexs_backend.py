@@ -411,9 +411,7 @@ class WfExSBackend:
         """
         # Getting a logger focused on specific classes
         self.logger = logging.getLogger(
-            dict(inspect.getmembers(self))["__module__"]
-            + "::"
-            + self.__class__.__name__
+            self.__class__.__module__ + "::" + self.__class__.__name__
         )
 
         if not isinstance(local_config, dict):
@@ -20,7 +20,6 @@ from __future__ import absolute_import
 import atexit
 import copy
 import datetime
-import inspect
 import json
 import logging
 import os
@@ -339,9 +338,7 @@ class WF:
 
         # Getting a logger focused on specific classes
         self.logger = logging.getLogger(
-            dict(inspect.getmembers(self))["__module__"]
-            + "::"
-            + self.__class__.__name__
+            self.__class__.__module__ + "::" + self.__class__.__name__
         )
 
         self.wfexs = wfexs
@@ -3190,6 +3187,18 @@ class WF:
 
         return retval
 
+    def _crate_hash_non_attached(self) -> "bool":
+        """
+        Whether the files which are not attached to the generated
+        RO-Crates have to be read, in order to record their digests
+        and MIME types
+        """
+        workflow_config = self.stagedSetup.workflow_config
+        if workflow_config is None:
+            return True
+
+        return bool(workflow_config.get("crate_hash_non_attached", True))
+
     def createStageResearchObject(
         self,
         filename: "Optional[AnyPath]" = None,
@@ -3221,6 +3230,7 @@ class WF:
             self.arch,
             staged_setup=self.stagedSetup,
             payloads=payloads,
+            hash_non_attached=self._crate_hash_non_attached(),
         )
 
         wrroc.addWorkflowInputs(
@@ -3276,6 +3286,7 @@ class WF:
             self.arch,
             staged_setup=self.stagedSetup,
             payloads=payloads,
+            hash_non_attached=self._crate_hash_non_attached(),
         )
 
         for stagedExec in self.stagedExecutions: